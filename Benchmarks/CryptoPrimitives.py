@@ -0,0 +1,54 @@
+##########################################################
+# Measures the hashing and symmetric cipher primitives   #
+# used on the data path, and RSA signing and uncached    #
+# verification for comparison. Also checks that link     #
+# tokens built by the crypto provider interoperate with  #
+# Fernet in both directions.                             #
+#                                                        #
+# Runs against the RNS in this repository, or against    #
+# another checkout given as the first argument. On trees #
+# without a crypto provider, link tokens are measured    #
+# through Fernet the way links used to create them.      #
+##########################################################
+
+import os
+import sys
+import base64
+import timeit
+
+rns_path = sys.argv[1] if len(sys.argv) > 1 else os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, rns_path)
+import RNS
+from cryptography.fernet import Fernet
+
+RNS.loglevel = -1
+
+def measure(name, function, rounds=20000):
+	elapsed = timeit.timeit(function, number=rounds)/rounds
+	print "%-32s %7.2f us" % (name, elapsed*1e6)
+
+data = os.urandom(300)
+measure("Identity.truncatedHash", lambda: RNS.Identity.truncatedHash(data))
+measure("Destination.getDestinationHash", lambda: RNS.Destination.getDestinationHash("app", "a", "b"))
+
+key = os.urandom(32)
+plaintext = os.urandom(200)
+if hasattr(RNS, "CryptoProvider"):
+	provider = RNS.CryptoProvider.get()
+	token = provider.fernetEncrypt(key, plaintext)
+	measure("Link encrypt, 200 bytes", lambda: provider.fernetEncrypt(key, plaintext), 5000)
+	measure("Link decrypt, 200 bytes", lambda: provider.fernetDecrypt(key, token), 5000)
+
+	assert provider.fernetDecrypt(key, base64.urlsafe_b64decode(Fernet(base64.urlsafe_b64encode(key)).encrypt(plaintext))) == plaintext
+	assert Fernet(base64.urlsafe_b64encode(key)).decrypt(base64.urlsafe_b64encode(token)) == plaintext
+else:
+	fernet = lambda: Fernet(base64.urlsafe_b64encode(key))
+	token = base64.urlsafe_b64decode(fernet().encrypt(plaintext))
+	measure("Link encrypt, 200 bytes", lambda: base64.urlsafe_b64decode(fernet().encrypt(plaintext)), 5000)
+	measure("Link decrypt, 200 bytes", lambda: fernet().decrypt(base64.urlsafe_b64encode(token)), 5000)
+
+identity = RNS.Identity()
+signature = identity.sign(data)
+RNS.Identity.verification_cache_size = 0
+measure("RSA sign", lambda: identity.sign(data), 500)
+measure("RSA verify", lambda: identity.validate(signature, data), 2000)
@@ -0,0 +1,40 @@
+##########################################################
+# Measures encryption and decryption of 200 byte         #
+# payloads for GROUP destinations, with AES-GCM and with #
+# Fernet tokens, and the overhead each adds.             #
+#                                                        #
+# Runs against the RNS in this repository, or against    #
+# another checkout given as the first argument.          #
+##########################################################
+
+import os
+import sys
+import timeit
+
+rns_path = sys.argv[1] if len(sys.argv) > 1 else os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, rns_path)
+import RNS
+
+RNS.loglevel = -1
+
+destination = RNS.Destination(None, RNS.Destination.OUT, RNS.Destination.GROUP, "benchmarks", "group")
+destination.createKeys()
+plaintext = os.urandom(200)
+
+# Older trees only have the Fernet format
+if hasattr(RNS.Reticulum, "should_use_group_aead"):
+	modes = [("aes-gcm", True), ("fernet", False)]
+else:
+	modes = [("fernet", None)]
+
+for name, use_aead in modes:
+	if use_aead != None:
+		RNS.Reticulum._Reticulum__use_group_aead = use_aead
+
+	ciphertext = destination.encrypt(plaintext)
+	assert destination.decrypt(ciphertext) == plaintext
+
+	rounds = 5000
+	encrypt_time = timeit.timeit(lambda: destination.encrypt(plaintext), number=rounds)/rounds
+	decrypt_time = timeit.timeit(lambda: destination.decrypt(ciphertext), number=rounds)/rounds
+	print "%-8s encrypt %5.1f us  decrypt %5.1f us  overhead %d bytes  %.0f round trips/s" % (name, encrypt_time*1e6, decrypt_time*1e6, len(ciphertext)-len(plaintext), 1/(encrypt_time+decrypt_time))
@@ -0,0 +1,43 @@
+##########################################################
+# Compares RSA-only and hybrid encryption for SINGLE     #
+# destinations. Measures Identity.decrypt on both paths  #
+# and prints the ciphertext size for several payload     #
+# lengths. Payloads that fit a single RSA block are      #
+# encrypted the same way in both modes.                  #
+#                                                        #
+# Runs against the RNS in this repository, or against    #
+# another checkout given as the first argument.          #
+##########################################################
+
+import os
+import sys
+import timeit
+
+rns_path = sys.argv[1] if len(sys.argv) > 1 else os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, rns_path)
+import RNS
+
+RNS.loglevel = -1
+
+identity = RNS.Identity()
+public_identity = RNS.Identity(public_only=True)
+public_identity.loadPublicKey(identity.getPublicKey())
+
+# Older trees only have the RSA-only path
+if hasattr(RNS.Reticulum, "should_use_hybrid_encryption"):
+	modes = [("rsa", False), ("hybrid", True)]
+else:
+	modes = [("rsa", None)]
+
+for size in (64, 200, 400, 477):
+	plaintext = os.urandom(size)
+	for name, use_hybrid in modes:
+		if use_hybrid != None:
+			RNS.Reticulum._Reticulum__use_hybrid_encryption = use_hybrid
+
+		ciphertext = public_identity.encrypt(plaintext)
+		assert identity.decrypt(ciphertext) == plaintext
+
+		rounds = 500
+		decrypt_time = timeit.timeit(lambda: identity.decrypt(ciphertext), number=rounds)/rounds
+		print "%-6s %3d bytes: ciphertext %4d bytes, overhead %3d bytes, decrypt %6.0f us" % (name, size, len(ciphertext), len(ciphertext)-size, decrypt_time*1e6)
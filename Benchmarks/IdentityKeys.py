@@ -0,0 +1,41 @@
+##########################################################
+# Compares RSA and Curve25519 identities. Measures key   #
+# generation, signing and uncached verification, and     #
+# the size of the resulting announce.                    #
+#                                                        #
+# Runs against the RNS in this repository, or against    #
+# another checkout given as the first argument.          #
+##########################################################
+
+import os
+import sys
+import timeit
+
+rns_path = sys.argv[1] if len(sys.argv) > 1 else os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, rns_path)
+import RNS
+
+RNS.loglevel = -1
+RNS.Identity.verification_cache_size = 0
+
+for key_type, name in ((RNS.Identity.RSA, "RSA-1024"), (RNS.Identity.CURVE25519, "Curve25519")):
+	rounds = 20
+	keygen_time = timeit.timeit(lambda: RNS.Identity(key_type=key_type), number=rounds)/rounds
+
+	identity = RNS.Identity(key_type=key_type)
+	public_identity = RNS.Identity(public_only=True)
+	public_identity.loadPublicKey(identity.getPublicKey())
+
+	message = os.urandom(200)
+	signature = identity.sign(message)
+	assert public_identity.validate(signature, message)
+
+	rounds = 500
+	sign_time = timeit.timeit(lambda: identity.sign(message), number=rounds)/rounds
+	verify_time = timeit.timeit(lambda: public_identity.validate(signature, message), number=rounds)/rounds
+
+	# Destination hash, public key, random hash
+	# and signature, without any app data
+	announce_size = 10+len(identity.getPublicKey())+10+len(signature)
+
+	print "%-10s keygen %8.0f us  sign %5.0f us  verify %5.0f us  announce %d bytes" % (name, keygen_time*1e6, sign_time*1e6, verify_time*1e6, announce_size)
@@ -0,0 +1,38 @@
+##########################################################
+# Measures the hash requests made on the send path of a  #
+# packet. Outbound, the packet receipt and the packet    #
+# cache each ask for the hash of the same packet.        #
+#                                                        #
+# Runs against the RNS in this repository, or against    #
+# another checkout given as the first argument.          #
+##########################################################
+
+import os
+import sys
+import timeit
+
+rns_path = sys.argv[1] if len(sys.argv) > 1 else os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, rns_path)
+import RNS
+
+# A stand-in for a plain destination, so
+# no keys or interfaces need to be set up
+class BenchDestination:
+	pass
+
+destination = BenchDestination()
+destination.type = RNS.Destination.PLAIN
+destination.hash = os.urandom(10)
+destination.encrypt = lambda plaintext: plaintext
+
+packet = RNS.Packet(destination, os.urandom(400))
+packet.pack()
+
+def send_path_hashes():
+	packet.updateHash()
+	packet.getHash()
+	packet.getHash()
+
+rounds = 100000
+elapsed = timeit.timeit(send_path_hashes, number=rounds)
+print "Send path hashing of a 400 byte packet: %.2f us" % (elapsed/rounds*1e6)
@@ -0,0 +1,40 @@
+##########################################################
+# Measures the memory overhead of packed packets and     #
+# their receipts, counting the instance dict where there #
+# is one, with payload strings left out.                 #
+#                                                        #
+# Runs against the RNS in this repository, or against    #
+# another checkout given as the first argument.          #
+##########################################################
+
+import os
+import sys
+
+rns_path = sys.argv[1] if len(sys.argv) > 1 else os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, rns_path)
+import RNS
+
+# A stand-in for a link, so no keys or
+# interfaces need to be set up
+class BenchLink:
+	pass
+
+def size(obj):
+	size = sys.getsizeof(obj)
+	if hasattr(obj, "__dict__"):
+		size += sys.getsizeof(obj.__dict__)
+	return size
+
+link = BenchLink()
+link.type = RNS.Destination.LINK
+link.hash = os.urandom(10)
+link.status = 0
+link.mtu = RNS.Reticulum.MTU
+
+packet = RNS.Packet(link, os.urandom(400), context=RNS.Packet.RESOURCE)
+packet.pack()
+packet.map_hash = "abcd"
+receipt = RNS.PacketReceipt(packet)
+
+print "Packed resource part: %d bytes" % size(packet)
+print "In-flight receipt:    %d bytes, callbacks %d bytes" % (size(receipt), size(receipt.callbacks))
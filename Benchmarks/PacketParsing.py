@@ -0,0 +1,53 @@
+##########################################################
+# Measures inbound parsing throughput: unpacking a raw   #
+# packet, reading the header fields Transport looks at   #
+# first, and hashing it, over a mix of small data        #
+# packets, full size resource parts and packets with a   #
+# transport header.                                      #
+#                                                        #
+# Runs against the RNS in this repository, or against    #
+# another checkout given as the first argument, which    #
+# gives the old code path to compare with.               #
+##########################################################
+
+import os
+import sys
+import timeit
+
+rns_path = sys.argv[1] if len(sys.argv) > 1 else os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, rns_path)
+import RNS
+
+RNS.loglevel = -1
+
+def raw_packet(header_type, context, payload_size):
+	flags = chr(header_type << 6)
+	if header_type == RNS.Packet.HEADER_2:
+		address = os.urandom(20)
+	else:
+		address = os.urandom(10)
+	return flags+chr(1)+address+chr(context)+os.urandom(payload_size)
+
+packet_mix = [
+	("data, 64 bytes", raw_packet(RNS.Packet.HEADER_1, RNS.Packet.NONE, 64)),
+	("resource part, 477 bytes", raw_packet(RNS.Packet.HEADER_1, RNS.Packet.RESOURCE, 477)),
+	("transported, 200 bytes", raw_packet(RNS.Packet.HEADER_2, RNS.Packet.NONE, 200)),
+]
+
+def parse(raw):
+	packet = RNS.Packet(None, raw)
+	packet.unpack()
+	packet.destination_hash
+	packet.context
+	packet.getHash()
+
+rounds = 50000
+total_time = 0
+total_bytes = 0
+for name, raw in packet_mix:
+	elapsed = timeit.timeit(lambda: parse(raw), number=rounds)
+	total_time += elapsed
+	total_bytes += len(raw)*rounds
+	print "%-26s %5.2f us per packet" % (name, elapsed/rounds*1e6)
+
+print "%-26s %5.0f packets/s, %.1f MB/s" % ("whole mix", rounds*len(packet_mix)/total_time, total_bytes/total_time/1e6)
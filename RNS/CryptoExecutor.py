@@ -0,0 +1,56 @@
+import RNS
+import threading
+from Queue import Queue
+
+# Runs inbound packet processing, which is where
+# signatures are checked, packets are decrypted and
+# proofs are signed, on a set of worker threads. The
+# cryptography library releases the GIL during these
+# operations, so they can use several cores. Each key
+# is always handled by the same worker, so work for
+# one destination or link keeps its order.
+class CryptoExecutor:
+	# Number of worker threads. With no workers,
+	# everything runs inline on the calling thread.
+	workers = 0
+
+	# When a worker queue is full, the submitting
+	# interface waits until there is room again
+	QUEUE_DEPTH = 256
+
+	queues = []
+	started = False
+
+	@staticmethod
+	def start():
+		if not CryptoExecutor.started and CryptoExecutor.workers > 0:
+			for i in range(CryptoExecutor.workers):
+				queue = Queue(maxsize=CryptoExecutor.QUEUE_DEPTH)
+				CryptoExecutor.queues.append(queue)
+				thread = threading.Thread(target=CryptoExecutor.workerLoop, args=(queue,))
+				thread.setDaemon(True)
+				thread.start()
+
+			CryptoExecutor.started = True
+			RNS.log("Started "+str(CryptoExecutor.workers)+" crypto workers", RNS.LOG_VERBOSE)
+
+	@staticmethod
+	def enabled():
+		return CryptoExecutor.started
+
+	@staticmethod
+	def workerLoop(queue):
+		while True:
+			job, args = queue.get()
+			try:
+				job(*args)
+			except Exception as e:
+				RNS.log("Error in crypto worker. The contained exception was: "+str(e), RNS.LOG_ERROR)
+
+	@staticmethod
+	def submit(key, job, *args):
+		if CryptoExecutor.started:
+			queue = CryptoExecutor.queues[hash(key) % len(CryptoExecutor.queues)]
+			queue.put((job, args))
+		else:
+			job(*args)
@@ -0,0 +1,130 @@
+import os
+import hmac
+import time
+import base64
+import struct
+import hashlib
+import threading
+from collections import OrderedDict
+from cryptography.fernet import Fernet
+from cryptography.fernet import InvalidToken
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import padding as symmetric_padding
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.hazmat.primitives.asymmetric import padding
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+# Hashing and symmetric cipher primitives used by
+# the protocol code. Hashes use the hashlib fast
+# path, and cipher objects are cached per key, so
+# they are not rebuilt for every packet. Padding
+# and signature parameters are created once and
+# reused. A different implementation can be swapped
+# in with CryptoProvider.set(), without touching
+# any of the code that uses it.
+class CryptoProvider:
+	# Maximum number of cached cipher objects
+	CIPHER_CACHE_SIZE = 64
+
+	provider = None
+
+	@staticmethod
+	def get():
+		if CryptoProvider.provider == None:
+			CryptoProvider.provider = CryptoProvider()
+		return CryptoProvider.provider
+
+	@staticmethod
+	def set(provider):
+		CryptoProvider.provider = provider
+
+	def __init__(self):
+		self.ciphers = OrderedDict()
+		self.ciphers_lock = threading.Lock()
+		self.backend = default_backend()
+
+		self.oaep_padding = padding.OAEP(
+			mgf=padding.MGF1(algorithm=hashes.SHA1()),
+			algorithm=hashes.SHA1(),
+			label=None
+		)
+		self.pss_padding = padding.PSS(
+			mgf=padding.MGF1(hashes.SHA256()),
+			salt_length=padding.PSS.MAX_LENGTH
+		)
+		self.sha256_algorithm = hashes.SHA256()
+		self.ecdsa_algorithm = ec.ECDSA(hashes.SHA256())
+
+	def sha256(self, data):
+		return hashlib.sha256(data).digest()
+
+	def hmac(self, key, data):
+		return hmac.new(key, data, hashlib.sha256).digest()
+
+	def oaep(self):
+		return self.oaep_padding
+
+	def pss(self):
+		return self.pss_padding
+
+	def sha256Algorithm(self):
+		return self.sha256_algorithm
+
+	def ecdsa(self):
+		return self.ecdsa_algorithm
+
+	# Encrypts to a raw Fernet token, which is the
+	# same as a decoded Fernet.encrypt() result, but
+	# without the base64 round trip and the per call
+	# setup that Fernet does.
+	def fernetEncrypt(self, key, plaintext):
+		signing_key, encryption_key = self.fernetKeys(key)
+		iv = os.urandom(16)
+		padder = symmetric_padding.PKCS7(algorithms.AES.block_size).padder()
+		padded = padder.update(plaintext)+padder.finalize()
+		encryptor = Cipher(encryption_key, modes.CBC(iv), self.backend).encryptor()
+		ciphertext = encryptor.update(padded)+encryptor.finalize()
+
+		token = chr(0x80)+struct.pack(">Q", int(time.time()))+iv+ciphertext
+		return token+hmac.new(signing_key, token, hashlib.sha256).digest()
+
+	def fernetDecrypt(self, key, token):
+		signing_key, encryption_key = self.fernetKeys(key)
+		if len(token) < 57 or token[0] != chr(0x80):
+			raise InvalidToken
+		mac = hmac.new(signing_key, token[:-32], hashlib.sha256).digest()
+		if not hmac.compare_digest(mac, token[-32:]):
+			raise InvalidToken
+
+		iv = token[9:25]
+		decryptor = Cipher(encryption_key, modes.CBC(iv), self.backend).decryptor()
+		padded = decryptor.update(token[25:-32])+decryptor.finalize()
+		unpadder = symmetric_padding.PKCS7(algorithms.AES.block_size).unpadder()
+		try:
+			return unpadder.update(padded)+unpadder.finalize()
+		except ValueError:
+			raise InvalidToken
+
+	def fernetKeys(self, key):
+		return self.cachedCipher("fernet_keys", key, lambda: (key[:16], algorithms.AES(key[16:])))
+
+	# Returns a Fernet instance for a raw 32 byte key
+	def fernet(self, key):
+		return self.cachedCipher("fernet", key, lambda: Fernet(base64.urlsafe_b64encode(key)))
+
+	def aead(self, key):
+		return self.cachedCipher("aead", key, lambda: AESGCM(key))
+
+	def cachedCipher(self, kind, key, create):
+		cache_key = (kind, key)
+		with self.ciphers_lock:
+			try:
+				cipher = self.ciphers.pop(cache_key)
+			except KeyError:
+				cipher = create()
+				while len(self.ciphers) >= CryptoProvider.CIPHER_CACHE_SIZE:
+					self.ciphers.popitem(last=False)
+			self.ciphers[cache_key] = cipher
+			return cipher
@@ -1,13 +1,17 @@
 import base64
 import math
+import time
+import os
 import RNS
 
 from cryptography.fernet import Fernet
+from cryptography.exceptions import InvalidTag
 from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.backends import default_backend
 from cryptography.hazmat.primitives import serialization
 from cryptography.hazmat.primitives.asymmetric import rsa
 from cryptography.hazmat.primitives.asymmetric import padding
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
 
 class Callbacks:
 	def __init__(self):
@@ -35,6 +39,19 @@ class Destination:
 	OUT        = 0x12;
 	directions = [IN, OUT]
 
+	# Group destinations encrypt with AES-GCM under a
+	# key derived from the group key. The ciphertext
+	# is the nonce followed by the sealed payload.
+	GROUP_NONCESIZE = 96	# In bits
+
+	# Periodic announces are delayed by a random part
+	# of this fraction of the interval, unless a jitter
+	# is given. When other nodes are heard rebroadcasting
+	# our announce, the interval is doubled, up to the
+	# maximum backoff factor.
+	ANNOUNCE_JITTER = 0.1
+	ANNOUNCE_BACKOFF_MAX = 4
+
 	@staticmethod
 	def getDestinationName(app_name, *aspects):
 		# Check input values and build name string
@@ -53,10 +70,7 @@ class Destination:
 		name = Destination.getDestinationName(app_name, *aspects)
 
 		# Create a digest for the destination
-		digest = hashes.Hash(hashes.SHA256(), backend=default_backend())
-		digest.update(name)
-
-		return digest.finalize()[:10]
+		return RNS.CryptoProvider.get().sha256(name)[:10]
 
 
 	def __init__(self, identity, direction, type, app_name, *aspects):
@@ -76,7 +90,7 @@ class Destination:
 			aspects = aspects+(identity.hexhash,)
 
 		if identity == None and direction == Destination.IN:
-			identity = Identity()
+			identity = RNS.KeyPool.getIdentity()
 			aspects = aspects+(identity.hexhash,)
 
 		self.identity = identity
@@ -87,6 +101,14 @@ class Destination:
 
 		self.callback = None
 		self.proofcallback = None
+		self.header_templates = {}
+
+		self.announce_interval = None
+		self.announce_jitter = 0
+		self.announce_app_data = None
+		self.announce_backoff = 1
+		self.announce_rebroadcast_heard = False
+		self.next_announce = None
 
 		RNS.Transport.registerDestination(self)
 
@@ -133,8 +155,7 @@ class Destination:
 			raise TypeError("A single destination holds keys through an Identity instance")
 
 		if self.type == Destination.GROUP:
-			self.prv_bytes = Fernet.generate_key()
-			self.prv = Fernet(self.prv_bytes)
+			self.loadPrivateKey(Fernet.generate_key())
 
 
 	def getPrivateKey(self):
@@ -156,6 +177,14 @@ class Destination:
 		if self.type == Destination.GROUP:
 			self.prv_bytes = key
 			self.prv = Fernet(self.prv_bytes)
+			self.group_key = base64.urlsafe_b64decode(self.prv_bytes)
+			self.group_aead_key = HKDF(
+				algorithm=hashes.SHA256(),
+				length=32,
+				salt=None,
+				info="group",
+				backend=default_backend()
+			).derive(self.group_key)
 
 	def loadPublicKey(self, key):
 		if self.type != Destination.SINGLE:
@@ -173,7 +202,11 @@ class Destination:
 
 		if self.type == Destination.GROUP and self.prv != None:
 			try:
-				return base64.urlsafe_b64decode(self.prv.encrypt(plaintext))
+				if RNS.Reticulum.should_use_group_aead():
+					nonce = os.urandom(Destination.GROUP_NONCESIZE/8)
+					return nonce+RNS.CryptoProvider.get().aead(self.group_aead_key).encrypt(nonce, plaintext, None)
+				else:
+					return RNS.CryptoProvider.get().fernetEncrypt(self.group_key, plaintext)
 			except:
 				return None
 
@@ -186,7 +219,13 @@ class Destination:
 			return self.identity.decrypt(ciphertext)
 
 		if self.type == Destination.GROUP:
-			return self.prv.decrypt(base64.urlsafe_b64encode(ciphertext))
+			# Packets from nodes that do not use the
+			# AES-GCM format are still Fernet tokens
+			nonce = ciphertext[:Destination.GROUP_NONCESIZE/8]
+			try:
+				return RNS.CryptoProvider.get().aead(self.group_aead_key).decrypt(nonce, ciphertext[Destination.GROUP_NONCESIZE/8:], None)
+			except InvalidTag:
+				return RNS.CryptoProvider.get().fernetDecrypt(self.group_key, ciphertext)
 
 
 	def sign(self, message):
@@ -198,23 +237,65 @@ class Destination:
 
 	# Creates an announce packet for this destination.
 	# Application specific data can be added to the announce.
+	# Every announce is signed with a new random hash, since
+	# receivers drop a packet they have already seen.
 	def announce(self,app_data=None):
+		self.announce_rebroadcast_heard = False
 		destination_hash = self.hash
 		random_hash = RNS.Identity.getRandomHash()
 		
-		signed_data = self.hash+self.identity.getPublicKey()+random_hash
+		compact_key = None
+		if RNS.Reticulum.should_use_compact_announces():
+			compact_key = self.identity.getCompactPublicKey()
+
+		if compact_key != None:
+			# Compact announces leave out the destination
+			# hash, which is already in the header, but
+			# still cover it with the signature
+			announce_header = chr(RNS.Identity.ANNOUNCE_COMPACT)+compact_key+random_hash
+			signed_data = self.hash+announce_header
+		else:
+			announce_header = self.hash+self.identity.getPublicKey()+random_hash
+			signed_data = announce_header
+
 		if app_data != None:
 			signed_data += app_data
 
 		signature = self.identity.sign(signed_data)
-
-		# TODO: Check if this could be optimised by only
-		# carrying the hash in the destination field, not
-		# also redundantly inside the signed blob as here
-		announce_data = self.hash+self.identity.getPublicKey()+random_hash+signature
+		announce_data = announce_header+signature
 
 		if app_data != None:
 			announce_data += app_data
 
 		RNS.Packet(self, announce_data, RNS.Packet.ANNOUNCE).send()
 
+	# Makes Reticulum announce this destination every
+	# interval seconds, so applications do not need
+	# their own announce loop
+	def announce_periodically(self, interval, jitter=None, app_data=None):
+		if jitter == None:
+			jitter = interval*Destination.ANNOUNCE_JITTER
+
+		self.announce_interval = interval
+		self.announce_jitter = jitter
+		self.announce_app_data = app_data
+		self.announce_backoff = 1
+		self.next_announce = time.time()+RNS.rand()*self.announce_jitter
+		RNS.Transport.scheduleAnnounces(self)
+
+	def stop_announcing(self):
+		self.announce_interval = None
+		self.next_announce = None
+		RNS.Transport.unscheduleAnnounces(self)
+
+	# Called by Transport when a periodic announce is
+	# due. Returns the time of the next one.
+	def scheduleNextAnnounce(self):
+		if self.announce_rebroadcast_heard:
+			self.announce_backoff = min(self.announce_backoff*2, Destination.ANNOUNCE_BACKOFF_MAX)
+		else:
+			self.announce_backoff = 1
+
+		self.next_announce = time.time()+self.announce_interval*self.announce_backoff+RNS.rand()*self.announce_jitter
+		return self.next_announce
+
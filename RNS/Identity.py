@@ -3,8 +3,11 @@ import math
 import os
 import RNS
 import time
+import struct
 import atexit
+import threading
 import vendor.umsgpack as umsgpack
+from collections import OrderedDict
 from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.backends import default_backend
 from cryptography.hazmat.primitives import serialization
@@ -12,6 +15,10 @@ from cryptography.hazmat.primitives.serialization import load_der_public_key
 from cryptography.hazmat.primitives.serialization import load_der_private_key
 from cryptography.hazmat.primitives.asymmetric import rsa
 from cryptography.hazmat.primitives.asymmetric import padding
+from cryptography.hazmat.primitives.asymmetric import ed25519
+from cryptography.hazmat.primitives.asymmetric import x25519
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 
 class Identity:
    #KEYSIZE     = 1536
@@ -21,82 +28,234 @@ class Identity:
 	# Non-configurable constants
 	PADDINGSIZE = 336		# In bits
 	HASHLENGTH  = 256		# In bits
+	TRUNCATED_HASHLENGTH = 80	# In bits
+	AGGREGATE_HASHLENGTH = 128	# In bits
 	SIGLENGTH   = KEYSIZE
 
+	# Hybrid encryption wraps a random AES-GCM key in
+	# a single RSA block that starts with this marker,
+	# and encrypts the payload with that key
+	HYBRID_MARKER   = "\xfe"
+	HYBRID_KEYSIZE  = 128	# In bits
+	HYBRID_NONCESIZE = 96	# In bits
+
+	# Identity key types. Curve25519 identities use
+	# X25519 for encryption and Ed25519 for signing.
+	# Their keys start with the key type, which can
+	# not be confused with DER encoded RSA keys, since
+	# those always start with 0x30.
+	RSA        = 0x00
+	CURVE25519 = 0x01
+	key_types  = [RSA, CURVE25519]
+
+	CURVE25519_KEYSIZE    = 256		# In bits
+	CURVE25519_PUBKEYSIZE = 8+2*CURVE25519_KEYSIZE
+	CURVE25519_SIGLENGTH  = 512		# In bits
+
+	# Key type used for newly created identities
+	default_key_type = RSA
+
+	# Compact announces start with a version byte
+	# instead of the destination hash, and carry the
+	# public key in raw form. RSA keys are sent as
+	# their modulus, which is only possible for keys
+	# using the standard public exponent.
+	ANNOUNCE_COMPACT = 0x01
+	RSA_EXPONENT     = 65337
+
 	# Storage
 	known_destinations = {}
 
+	# Recently recalled identities, so the public
+	# keys of peers we talk to often are not parsed
+	# again on every recall. Least recently used
+	# entries are dropped when the cache is full.
+	recall_cache = OrderedDict()
+	recall_cache_lock = threading.Lock()
+	recall_cache_size = 256
+	recall_cache_hits = 0
+	recall_cache_misses = 0
+
+	# Results of recent signature verifications. The
+	# same announce is heard again from every neighbour
+	# that rebroadcasts it, and only needs to be
+	# verified once.
+	verification_cache = OrderedDict()
+	verification_cache_lock = threading.Lock()
+	verification_cache_size = 1024
+	verification_cache_hits = 0
+	verification_cache_misses = 0
+
 	@staticmethod
 	def remember(packet_hash, destination_hash, public_key, app_data = None):
 		RNS.log("Remembering "+RNS.prettyhexrep(destination_hash), RNS.LOG_VERBOSE)
+		if destination_hash in Identity.known_destinations:
+			if Identity.known_destinations[destination_hash][2] != public_key:
+				with Identity.recall_cache_lock:
+					Identity.recall_cache.pop(destination_hash, None)
 		Identity.known_destinations[destination_hash] = [time.time(), packet_hash, public_key, app_data]
 
 
 	@staticmethod
 	def recall(destination_hash):
 		RNS.log("Searching for "+RNS.prettyhexrep(destination_hash)+"...", RNS.LOG_DEBUG)
-		if destination_hash in Identity.known_destinations:
+		with Identity.recall_cache_lock:
+			identity = Identity.recall_cache.pop(destination_hash, None)
+			if identity != None:
+				Identity.recall_cache[destination_hash] = identity
+				Identity.recall_cache_hits += 1
+
+		if identity != None:
+			RNS.log("Found "+RNS.prettyhexrep(destination_hash)+" in recall cache", RNS.LOG_DEBUG)
+			return identity
+		elif destination_hash in Identity.known_destinations:
 			identity_data = Identity.known_destinations[destination_hash]
 			identity = Identity(public_only=True)
 			identity.loadPublicKey(identity_data[2])
+			with Identity.recall_cache_lock:
+				Identity.recall_cache_misses += 1
+				if Identity.recall_cache_size > 0:
+					Identity.recall_cache[destination_hash] = identity
+					while len(Identity.recall_cache) > Identity.recall_cache_size:
+						Identity.recall_cache.popitem(last=False)
 			RNS.log("Found "+RNS.prettyhexrep(destination_hash)+" in known destinations", RNS.LOG_DEBUG)
 			return identity
 		else:
 			RNS.log("Could not find "+RNS.prettyhexrep(destination_hash)+" in known destinations", RNS.LOG_DEBUG)
 			return None
 
+	@staticmethod
+	def recallCacheStatistics():
+		return {
+			"size": len(Identity.recall_cache),
+			"max_size": Identity.recall_cache_size,
+			"hits": Identity.recall_cache_hits,
+			"misses": Identity.recall_cache_misses
+		}
+
+	@staticmethod
+	def verificationCacheStatistics():
+		return {
+			"size": len(Identity.verification_cache),
+			"max_size": Identity.verification_cache_size,
+			"hits": Identity.verification_cache_hits,
+			"misses": Identity.verification_cache_misses
+		}
+
 	@staticmethod
 	def saveKnownDestinations():
-		RNS.log("Saving known destinations to storage...", RNS.LOG_VERBOSE)
-		file = open(RNS.Reticulum.storagepath+"/known_destinations","w")
-		umsgpack.dump(Identity.known_destinations, file)
-		file.close()
-		RNS.log("Done saving known destinations to storage", RNS.LOG_VERBOSE)
+		# Entries are written to storage as they are
+		# learned, so only the index needs saving here
+		if isinstance(Identity.known_destinations, RNS.KnownDestinations):
+			RNS.log("Saving known destinations index to storage...", RNS.LOG_VERBOSE)
+			Identity.known_destinations.close()
+			RNS.log("Done saving known destinations index to storage", RNS.LOG_VERBOSE)
 
 	@staticmethod
 	def loadKnownDestinations():
-		if os.path.isfile(RNS.Reticulum.storagepath+"/known_destinations"):
-			try:
-				file = open(RNS.Reticulum.storagepath+"/known_destinations","r")
-				Identity.known_destinations = umsgpack.load(file)
-				file.close()
-				RNS.log("Loaded "+str(len(Identity.known_destinations))+" known destinations from storage", RNS.LOG_VERBOSE)
-			except:
-				RNS.log("Error loading known destinations from disk, file will be recreated on exit", RNS.LOG_ERROR)
-		else:
-			RNS.log("Destinations file does not exist, so no known destinations loaded", RNS.LOG_VERBOSE)
+		try:
+			store = RNS.KnownDestinations(RNS.Reticulum.storagepath)
+			for destination_hash in Identity.known_destinations:
+				store[destination_hash] = Identity.known_destinations[destination_hash]
+			Identity.known_destinations = store
+			with Identity.recall_cache_lock:
+				Identity.recall_cache.clear()
+			RNS.log("Loaded "+str(len(Identity.known_destinations))+" known destinations from storage", RNS.LOG_VERBOSE)
+		except Exception as e:
+			RNS.log("Error loading known destinations from disk, they will only be kept in memory. The contained exception was: "+str(e), RNS.LOG_ERROR)
 
 	@staticmethod
 	def fullHash(data):
-		digest = hashes.Hash(hashes.SHA256(), backend=default_backend())
-		digest.update(data)
-
-		return digest.finalize()
+		return RNS.CryptoProvider.get().sha256(data)
 
 	@staticmethod
 	def truncatedHash(data):
-		digest = hashes.Hash(hashes.SHA256(), backend=default_backend())
-		digest.update(data)
-
-		return digest.finalize()[:10]
+		return RNS.CryptoProvider.get().sha256(data)[:Identity.TRUNCATED_HASHLENGTH/8]
 
 	@staticmethod
 	def getRandomHash():
 		return Identity.truncatedHash(os.urandom(10))
 
+	@staticmethod
+	def getKeyType(key):
+		if len(key) > 0 and key[0] == chr(Identity.CURVE25519):
+			return Identity.CURVE25519
+		else:
+			return Identity.RSA
+
+	# Splits announce data into the public key, random
+	# hash, signature, application data and the data
+	# covered by the signature. The sizes of the key
+	# and signature depend on the key type. Legacy
+	# announces repeat the destination hash at the
+	# start of the data, which is how they are told
+	# apart from compact ones.
+	@staticmethod
+	def unpackAnnounce(destination_hash, data):
+		if data[:10] == destination_hash:
+			key_start = 10
+			if Identity.getKeyType(data[10:11]) == Identity.CURVE25519:
+				keysize = Identity.CURVE25519_PUBKEYSIZE/8
+			else:
+				keysize = Identity.DERKEYSIZE/8
+		elif data[0:1] == chr(Identity.ANNOUNCE_COMPACT):
+			key_start = 1
+			if Identity.getKeyType(data[1:2]) == Identity.CURVE25519:
+				keysize = Identity.CURVE25519_PUBKEYSIZE/8
+			else:
+				keysize = Identity.KEYSIZE/8
+		else:
+			return None
+
+		raw_key = data[key_start:key_start+keysize]
+		if Identity.getKeyType(raw_key) == Identity.CURVE25519:
+			siglength = Identity.CURVE25519_SIGLENGTH/8
+		else:
+			siglength = Identity.SIGLENGTH/8
+
+		random_start = key_start+keysize
+		signature_start = random_start+10
+		app_data_start = signature_start+siglength
+
+		random_hash = data[random_start:signature_start]
+		signature = data[signature_start:app_data_start]
+		app_data = ""
+		if len(data) > app_data_start:
+			app_data = data[app_data_start:]
+
+		if key_start == 10:
+			public_key = raw_key
+			signed_data = destination_hash+public_key+random_hash+app_data
+		else:
+			public_key = Identity.expandPublicKey(raw_key)
+			signed_data = destination_hash+data[:signature_start]+app_data
+
+		return [public_key, random_hash, signature, app_data, signed_data]
+
+	# Converts a raw key from a compact announce
+	# back to the form returned by getPublicKey
+	@staticmethod
+	def expandPublicKey(raw_key):
+		if Identity.getKeyType(raw_key) == Identity.CURVE25519:
+			return raw_key
+		else:
+			modulus = int(raw_key.encode("hex_codec"), 16)
+			pub = rsa.RSAPublicNumbers(Identity.RSA_EXPONENT, modulus).public_key(default_backend())
+			return pub.public_bytes(
+				encoding=serialization.Encoding.DER,
+				format=serialization.PublicFormat.SubjectPublicKeyInfo
+			)
+
 	@staticmethod
 	def validateAnnounce(packet):
 		if packet.packet_type == RNS.Packet.ANNOUNCE:
 			RNS.log("Validating announce from "+RNS.prettyhexrep(packet.destination_hash), RNS.LOG_VERBOSE)
 			destination_hash = packet.destination_hash
-			public_key = packet.data[10:Identity.DERKEYSIZE/8+10]
-			random_hash = packet.data[Identity.DERKEYSIZE/8+10:Identity.DERKEYSIZE/8+20]
-			signature = packet.data[Identity.DERKEYSIZE/8+20:Identity.DERKEYSIZE/8+20+Identity.KEYSIZE/8]
-			app_data = ""
-			if len(packet.data) > Identity.DERKEYSIZE/8+20+Identity.KEYSIZE/8:
-				app_data = packet.data[Identity.DERKEYSIZE/8+20+Identity.KEYSIZE/8:]
-
-			signed_data = destination_hash+public_key+random_hash+app_data
+			try:
+				public_key, random_hash, signature, app_data, signed_data = Identity.unpackAnnounce(destination_hash, packet.data)
+			except Exception as e:
+				RNS.log("Received malformed announce", RNS.LOG_DEBUG)
+				return False
 
 			announced_identity = Identity(public_only=True)
 			announced_identity.loadPublicKey(public_key)
@@ -125,7 +284,7 @@ class Identity:
 			return None
 
 
-	def __init__(self,public_only=False):
+	def __init__(self,public_only=False,key_type=None):
 		# Initialize keys to none
 		self.prv = None
 		self.pub = None
@@ -134,10 +293,36 @@ class Identity:
 		self.hash = None
 		self.hexhash = None
 
+		# Curve25519 identities hold separate
+		# keys for signing and encryption
+		self.sig_prv = None
+		self.sig_pub = None
+
+		if key_type == None:
+			key_type = Identity.default_key_type
+		self.key_type = key_type
+
 		if not public_only:
 			self.createKeys()
 
 	def createKeys(self):
+		if self.key_type == Identity.CURVE25519:
+			self.prv = x25519.X25519PrivateKey.generate()
+			self.sig_prv = ed25519.Ed25519PrivateKey.generate()
+			self.prv_bytes = chr(Identity.CURVE25519)+self.prv.private_bytes(
+				encoding=serialization.Encoding.Raw,
+				format=serialization.PrivateFormat.Raw,
+				encryption_algorithm=serialization.NoEncryption()
+			)+self.sig_prv.private_bytes(
+				encoding=serialization.Encoding.Raw,
+				format=serialization.PrivateFormat.Raw,
+				encryption_algorithm=serialization.NoEncryption()
+			)
+			self.loadCurve25519PublicKeys(self.prv.public_key(), self.sig_prv.public_key())
+			self.updateHashes()
+			RNS.log("Curve25519 identity keys created for "+RNS.prettyhexrep(self.hash), RNS.LOG_VERBOSE)
+			return
+
 		self.prv = rsa.generate_private_key(
 			public_exponent=65337,
 			key_size=Identity.KEYSIZE,
@@ -164,8 +349,49 @@ class Identity:
 	def getPublicKey(self):
 		return self.pub_bytes
 
+	# Returns the public key in the raw form used by
+	# compact announces, or None if the key can only
+	# be sent in full
+	def getCompactPublicKey(self):
+		if self.key_type == Identity.CURVE25519:
+			return self.pub_bytes
+		else:
+			numbers = self.pub.public_numbers()
+			if numbers.e == Identity.RSA_EXPONENT and numbers.n.bit_length() == Identity.KEYSIZE:
+				return (("%0"+str(Identity.KEYSIZE/4)+"x") % numbers.n).decode("hex_codec")
+			else:
+				return None
+
+	def getSigLength(self):
+		if self.key_type == Identity.CURVE25519:
+			return Identity.CURVE25519_SIGLENGTH
+		else:
+			return Identity.SIGLENGTH
+
+	def loadCurve25519PublicKeys(self, pub, sig_pub):
+		self.pub = pub
+		self.sig_pub = sig_pub
+		self.pub_bytes = chr(Identity.CURVE25519)+self.pub.public_bytes(
+			encoding=serialization.Encoding.Raw,
+			format=serialization.PublicFormat.Raw
+		)+self.sig_pub.public_bytes(
+			encoding=serialization.Encoding.Raw,
+			format=serialization.PublicFormat.Raw
+		)
+
 	def loadPrivateKey(self, prv_bytes):
 		try:
+			self.key_type = Identity.getKeyType(prv_bytes)
+			if self.key_type == Identity.CURVE25519:
+				keysize = Identity.CURVE25519_KEYSIZE/8
+				self.prv_bytes = prv_bytes
+				self.prv = x25519.X25519PrivateKey.from_private_bytes(prv_bytes[1:keysize+1])
+				self.sig_prv = ed25519.Ed25519PrivateKey.from_private_bytes(prv_bytes[keysize+1:2*keysize+1])
+				self.loadCurve25519PublicKeys(self.prv.public_key(), self.sig_prv.public_key())
+				self.updateHashes()
+
+				return True
+
 			self.prv_bytes = prv_bytes
 			self.prv = serialization.load_der_private_key(
 				self.prv_bytes,
@@ -188,8 +414,18 @@ class Identity:
 
 	def loadPublicKey(self, key):
 		try:
-			self.pub_bytes = key
-			self.pub = load_der_public_key(self.pub_bytes, backend=default_backend())
+			self.key_type = Identity.getKeyType(key)
+			if self.key_type == Identity.CURVE25519:
+				keysize = Identity.CURVE25519_KEYSIZE/8
+				if len(key) != Identity.CURVE25519_PUBKEYSIZE/8:
+					raise ValueError("Invalid Curve25519 public key length")
+				self.loadCurve25519PublicKeys(
+					x25519.X25519PublicKey.from_public_bytes(key[1:keysize+1]),
+					ed25519.Ed25519PublicKey.from_public_bytes(key[keysize+1:])
+				)
+			else:
+				self.pub_bytes = key
+				self.pub = load_der_public_key(self.pub_bytes, backend=default_backend())
 			self.updateHashes()
 		except Exception as e:
 			RNS.log("Error while loading public key, the contained exception was: "+str(e), RNS.LOG_ERROR)
@@ -219,8 +455,16 @@ class Identity:
 			RNS.log("The contained exception was: "+str(e))
 
 	def encrypt(self, plaintext):
-		if self.pub != None:
+		if self.pub != None and self.key_type == Identity.CURVE25519:
+			return self.encryptCurve25519(plaintext)
+		elif self.pub != None:
 			chunksize = (Identity.KEYSIZE-Identity.PADDINGSIZE)/8
+
+			# Anything larger than a single RSA block is
+			# cheaper to send and decrypt in hybrid form
+			if len(plaintext) > chunksize and RNS.Reticulum.should_use_hybrid_encryption():
+				return self.encryptHybrid(plaintext)
+
 			chunks = int(math.ceil(len(plaintext)/(float(chunksize))))
 
 			ciphertext = "";
@@ -232,19 +476,59 @@ class Identity:
 				
 				ciphertext += self.pub.encrypt(
 					plaintext[start:end],
-					padding.OAEP(
-						mgf=padding.MGF1(algorithm=hashes.SHA1()),
-						algorithm=hashes.SHA1(),
-						label=None
-					)
+					RNS.CryptoProvider.get().oaep()
 				)
 			return ciphertext
 		else:
 			raise KeyError("Encryption failed because identity does not hold a public key")
 
 
+	def encryptHybrid(self, plaintext):
+		key = os.urandom(Identity.HYBRID_KEYSIZE/8)
+		nonce = os.urandom(Identity.HYBRID_NONCESIZE/8)
+		wrapped_key = self.pub.encrypt(
+			Identity.HYBRID_MARKER+key,
+			RNS.CryptoProvider.get().oaep()
+		)
+		return wrapped_key+nonce+AESGCM(key).encrypt(nonce, plaintext, wrapped_key)
+
+	# Encrypts to a Curve25519 identity with a key
+	# derived from an ephemeral X25519 exchange. Every
+	# message gets a fresh key, so a fixed nonce is safe.
+	def encryptCurve25519(self, plaintext):
+		ephemeral_key = x25519.X25519PrivateKey.generate()
+		ephemeral_pub_bytes = ephemeral_key.public_key().public_bytes(
+			encoding=serialization.Encoding.Raw,
+			format=serialization.PublicFormat.Raw
+		)
+		key = self.deriveCurve25519Key(ephemeral_key.exchange(self.pub))
+		nonce = chr(0)*(Identity.HYBRID_NONCESIZE/8)
+		return ephemeral_pub_bytes+AESGCM(key).encrypt(nonce, plaintext, ephemeral_pub_bytes)
+
+	def decryptCurve25519(self, ciphertext):
+		try:
+			ephemeral_pub_bytes = ciphertext[:Identity.CURVE25519_KEYSIZE/8]
+			ephemeral_pub = x25519.X25519PublicKey.from_public_bytes(ephemeral_pub_bytes)
+			key = self.deriveCurve25519Key(self.prv.exchange(ephemeral_pub))
+			nonce = chr(0)*(Identity.HYBRID_NONCESIZE/8)
+			return AESGCM(key).decrypt(nonce, ciphertext[Identity.CURVE25519_KEYSIZE/8:], ephemeral_pub_bytes)
+		except:
+			RNS.log("Decryption by "+RNS.prettyhexrep(self.hash)+" failed", RNS.LOG_VERBOSE)
+			return None
+
+	def deriveCurve25519Key(self, shared_key):
+		return HKDF(
+			algorithm=hashes.SHA256(),
+			length=Identity.HYBRID_KEYSIZE/8,
+			salt=self.hash,
+			info=None,
+			backend=default_backend()
+		).derive(shared_key)
+
 	def decrypt(self, ciphertext):
-		if self.prv != None:
+		if self.prv != None and self.key_type == Identity.CURVE25519:
+			return self.decryptCurve25519(ciphertext)
+		elif self.prv != None:
 			plaintext = None
 			try:
 				chunksize = (Identity.KEYSIZE)/8
@@ -257,14 +541,21 @@ class Identity:
 					if (chunk+1)*chunksize > len(ciphertext):
 						end = len(ciphertext)
 
-					plaintext += self.prv.decrypt(
+					block = self.prv.decrypt(
 						ciphertext[start:end],
-						padding.OAEP(
-							mgf=padding.MGF1(algorithm=hashes.SHA1()),
-							algorithm=hashes.SHA1(),
-							label=None
-						)
+						RNS.CryptoProvider.get().oaep()
 					)
+
+					# The first block tells us if this is
+					# hybrid encrypted. If the payload does
+					# not authenticate, it is treated as a
+					# legacy chunked ciphertext.
+					if chunk == 0 and len(ciphertext) > chunksize and self.isHybridKey(block):
+						hybrid_plaintext = self.decryptHybrid(block[1:], ciphertext)
+						if hybrid_plaintext != None:
+							return hybrid_plaintext
+
+					plaintext += block
 			except:
 				RNS.log("Decryption by "+RNS.prettyhexrep(self.hash)+" failed", RNS.LOG_VERBOSE)
 				
@@ -273,31 +564,67 @@ class Identity:
 			raise KeyError("Decryption failed because identity does not hold a private key")
 
 
+	def isHybridKey(self, block):
+		return len(block) == 1+Identity.HYBRID_KEYSIZE/8 and block[0] == Identity.HYBRID_MARKER
+
+	def decryptHybrid(self, key, ciphertext):
+		wrapped_key = ciphertext[:Identity.KEYSIZE/8]
+		nonce = ciphertext[Identity.KEYSIZE/8:Identity.KEYSIZE/8+Identity.HYBRID_NONCESIZE/8]
+		try:
+			return AESGCM(key).decrypt(nonce, ciphertext[Identity.KEYSIZE/8+Identity.HYBRID_NONCESIZE/8:], wrapped_key)
+		except:
+			return None
+
 	def sign(self, message):
-		if self.prv != None:
+		if self.sig_prv != None:
+			return self.sig_prv.sign(message)
+		elif self.prv != None:
 			signature = self.prv.sign(
 				message,
-				padding.PSS(
-					mgf=padding.MGF1(hashes.SHA256()),
-					salt_length=padding.PSS.MAX_LENGTH
-				),
-				hashes.SHA256()
+				RNS.CryptoProvider.get().pss(),
+				RNS.CryptoProvider.get().sha256Algorithm()
 			)
 			return signature
 		else:
 			raise KeyError("Signing failed because identity does not hold a private key")
 
 	def validate(self, signature, message):
-		if self.pub != None:
+		if Identity.verification_cache_size > 0 and self.pub_bytes != None:
+			# The key and signature are length prefixed,
+			# so different splits of the same bytes can
+			# not end up with the same cache key
+			key_material = struct.pack("!HH", len(self.pub_bytes), len(signature))+self.pub_bytes+signature+message
+			cache_key = RNS.CryptoProvider.get().sha256(key_material)
+			with Identity.verification_cache_lock:
+				if cache_key in Identity.verification_cache:
+					Identity.verification_cache_hits += 1
+					return Identity.verification_cache[cache_key]
+				Identity.verification_cache_misses += 1
+
+			valid = self.verifySignature(signature, message)
+
+			with Identity.verification_cache_lock:
+				Identity.verification_cache[cache_key] = valid
+				while len(Identity.verification_cache) > Identity.verification_cache_size:
+					Identity.verification_cache.popitem(last=False)
+			return valid
+		else:
+			return self.verifySignature(signature, message)
+
+	def verifySignature(self, signature, message):
+		if self.sig_pub != None:
+			try:
+				self.sig_pub.verify(signature, message)
+				return True
+			except Exception as e:
+				return False
+		elif self.pub != None:
 			try:
 				self.pub.verify(
 					signature,
 					message,
-					padding.PSS(
-						mgf=padding.MGF1(hashes.SHA256()),
-						salt_length=padding.PSS.MAX_LENGTH
-					),
-					hashes.SHA256()
+					RNS.CryptoProvider.get().pss(),
+					RNS.CryptoProvider.get().sha256Algorithm()
 				)
 				return True
 			except Exception as e:
@@ -318,5 +645,31 @@ class Identity:
 		proof = RNS.Packet(destination, proof_data, RNS.Packet.PROOF)
 		proof.send()
 
+	# Creates proof packets covering several received
+	# packets, each signed once over the truncated
+	# hashes of all the packets it covers. A packet
+	# that ends up alone gets a normal proof, which
+	# any sender can validate.
+	def aggregateProofs(self, packets):
+		proofs = []
+		hashlength = Identity.AGGREGATE_HASHLENGTH/8
+		per_proof = (RNS.Reticulum.MDU-self.getSigLength()/8)/hashlength
+		for i in range(0, len(packets), per_proof):
+			group = packets[i:i+per_proof]
+			if len(group) == 1:
+				packet = group[0]
+				signature = self.sign(packet.packet_hash)
+				if RNS.Reticulum.should_use_implicit_proof():
+					proof_data = signature
+				else:
+					proof_data = packet.packet_hash + signature
+				proofs.append(RNS.Packet(packet.generateProofDestination(), proof_data, RNS.Packet.PROOF))
+			else:
+				hashes = "".join([packet.packet_hash[:hashlength] for packet in group])
+				signature = self.sign(chr(RNS.Packet.PROOF_AGGREGATE)+hashes)
+				proofs.append(RNS.Packet(group[0].generateProofDestination(), hashes+signature, RNS.Packet.PROOF, context=RNS.Packet.PROOF_AGGREGATE))
+
+		return proofs
+
 	def __str__(self):
 		return RNS.prettyhexrep(self.hash)
@@ -1,3 +1,5 @@
+from RNS.Reticulum import Reticulum
+
 class Interface:
     IN  = False
     OUT = False
@@ -5,5 +7,14 @@ class Interface:
     RPT = False
     name = None
 
+    # Largest packet the interface can carry. This is
+    # the same as Reticulum.MTU unless an interface
+    # declares otherwise or it is set in the config.
+    MTU = Reticulum.MTU
+
+    # Whether established links on this interface
+    # may use the compact header format
+    compact_headers = False
+
     def __init__(self):
         pass
\ No newline at end of file
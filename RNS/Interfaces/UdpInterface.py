@@ -7,6 +7,9 @@ import sys
 import RNS
 
 class UdpInterface(Interface):
+    # Stays below a typical Ethernet MTU once
+    # the IP and UDP headers are added
+    MTU = 1400
 
     def __init__(self, owner, name, bindip=None, bindport=None, forwardip=None, forwardport=None):
         self.IN  = True
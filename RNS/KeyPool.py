@@ -0,0 +1,84 @@
+import RNS
+import threading
+from Queue import Queue, Full, Empty
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives.asymmetric import ec
+
+# Keeps pregenerated keys ready, so that link setup
+# and destination creation do not have to wait for
+# key generation. A background thread tops the pools
+# up whenever keys are taken from them. If a pool is
+# empty or has not been started, keys are generated
+# inline as before.
+class KeyPool:
+	# How many keys to keep ready in each pool.
+	# Identity keys are slow to generate and
+	# rarely needed, so that pool is off by
+	# default.
+	link_key_depth = 8
+	identity_depth = 0
+
+	link_keys = None
+	identities = None
+	refill_event = threading.Event()
+	started = False
+
+	@staticmethod
+	def start():
+		if not KeyPool.started:
+			KeyPool.link_keys = Queue(maxsize=max(KeyPool.link_key_depth, 1))
+			KeyPool.identities = Queue(maxsize=max(KeyPool.identity_depth, 1))
+			KeyPool.started = True
+
+			thread = threading.Thread(target=KeyPool.refillLoop)
+			thread.setDaemon(True)
+			thread.start()
+
+	@staticmethod
+	def refillLoop():
+		while True:
+			try:
+				while KeyPool.link_key_depth > 0 and not KeyPool.link_keys.full():
+					KeyPool.link_keys.put_nowait(KeyPool.generateLinkKey())
+
+				while KeyPool.identity_depth > 0 and not KeyPool.identities.full():
+					KeyPool.identities.put_nowait(RNS.Identity())
+			except Full:
+				pass
+			except Exception as e:
+				RNS.log("Error while refilling key pool. The contained exception was: "+str(e), RNS.LOG_ERROR)
+
+			KeyPool.refill_event.wait()
+			KeyPool.refill_event.clear()
+
+	@staticmethod
+	def generateLinkKey():
+		return ec.generate_private_key(RNS.Link.CURVE, default_backend())
+
+	# Returns an ephemeral EC private key for a link
+	@staticmethod
+	def getLinkKey():
+		if KeyPool.started and KeyPool.link_key_depth > 0:
+			try:
+				key = KeyPool.link_keys.get_nowait()
+				KeyPool.refill_event.set()
+				return key
+			except Empty:
+				RNS.log("Link key pool is empty, generating key inline", RNS.LOG_DEBUG)
+				KeyPool.refill_event.set()
+
+		return KeyPool.generateLinkKey()
+
+	# Returns a new identity with the default key type
+	@staticmethod
+	def getIdentity():
+		if KeyPool.started and KeyPool.identity_depth > 0:
+			try:
+				identity = KeyPool.identities.get_nowait()
+				KeyPool.refill_event.set()
+				if identity.key_type == RNS.Identity.default_key_type:
+					return identity
+			except Empty:
+				KeyPool.refill_event.set()
+
+		return RNS.Identity()
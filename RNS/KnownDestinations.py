@@ -0,0 +1,315 @@
+import os
+import RNS
+import time
+import struct
+import threading
+import vendor.umsgpack as umsgpack
+from collections import OrderedDict
+
+# Persistent store for the destinations Identity
+# has learned from announces. Entries are appended
+# to a log file as they arrive, and an index of
+# log offsets by destination hash lets entries be
+# loaded lazily the first time they are looked up.
+# The log is compacted in the background once it
+# is mostly made up of superseded entries, and
+# destinations that have not been heard for longer
+# than max_age are evicted when it is compacted.
+class KnownDestinations:
+	LOGFILE   = "known_destinations.log"
+	INDEXFILE = "known_destinations.idx"
+	LEGACYFILE = "known_destinations"
+
+	# Announces are heard again and again, so an
+	# unchanged entry is only rewritten when the
+	# stored last heard time is this old
+	HEARD_WRITE_INTERVAL = 60*60
+
+	# Compact the log when it holds more than this
+	# many times the size of the live entries
+	COMPACT_RATIO = 2
+	COMPACT_MIN_SIZE = 64*1024
+
+	LENGTH_PREFIX = "!I"
+	PREFIX_SIZE = struct.calcsize(LENGTH_PREFIX)
+
+	# Evict destinations not heard for 30 days
+	max_age = 30*24*60*60
+
+	# Number of loaded entries kept in memory. Least
+	# recently used entries are dropped when it is
+	# full, and read from the log again if needed.
+	entry_cache_size = 1024
+
+	def __init__(self, storagepath):
+		self.logpath = storagepath+"/"+KnownDestinations.LOGFILE
+		self.indexpath = storagepath+"/"+KnownDestinations.INDEXFILE
+		self.legacypath = storagepath+"/"+KnownDestinations.LEGACYFILE
+
+		# The index maps destination hashes to
+		# [offset, length, last_heard, written_at]
+		self.index = {}
+		self.entries = OrderedDict()
+		self.log_size = 0
+		self.live_size = 0
+		self.compacting = False
+		self.lock = threading.RLock()
+
+		self.loadIndex()
+		self.logfile = open(self.logpath, "ab")
+
+		if os.path.isfile(self.legacypath):
+			self.migrateLegacy()
+
+		if self.hasExpired():
+			self.compactInBackground()
+
+	def __contains__(self, destination_hash):
+		return destination_hash in self.index
+
+	def __len__(self):
+		return len(self.index)
+
+	def __iter__(self):
+		return iter(self.index.keys())
+
+	def __getitem__(self, destination_hash):
+		entry = self.get(destination_hash)
+		if entry == None:
+			raise KeyError(destination_hash)
+		return entry
+
+	def __setitem__(self, destination_hash, entry):
+		self.store(destination_hash, entry)
+
+	def get(self, destination_hash, default=None):
+		with self.lock:
+			if destination_hash in self.entries:
+				entry = self.entries.pop(destination_hash)
+				self.entries[destination_hash] = entry
+				return entry
+			elif destination_hash in self.index:
+				offset, length, last_heard, written_at = self.index[destination_hash]
+				try:
+					record = self.readRecord(offset, length)
+					entry = record[1:]
+					entry[0] = last_heard
+					self.cacheEntry(destination_hash, entry)
+					return entry
+				except Exception as e:
+					RNS.log("Could not read "+RNS.prettyhexrep(destination_hash)+" from known destinations log. The contained exception was: "+str(e), RNS.LOG_ERROR)
+					return default
+			else:
+				return default
+
+	# Entries have the same layout as before, a list
+	# of [last_heard, packet_hash, public_key, app_data]
+	def store(self, destination_hash, entry):
+		with self.lock:
+			last_heard = entry[0]
+			previous = self.get(destination_hash)
+			self.cacheEntry(destination_hash, entry)
+
+			# Every announce has a new packet hash, so only
+			# the public key and app data decide whether the
+			# entry has changed. Until the next write, the
+			# log keeps the packet hash it was written with.
+			if previous != None and previous[2:] == entry[2:]:
+				written_at = self.index[destination_hash][3]
+				self.index[destination_hash][2] = last_heard
+				if last_heard - written_at < KnownDestinations.HEARD_WRITE_INTERVAL:
+					return
+
+			self.appendRecord(destination_hash, entry)
+
+		if self.shouldCompact():
+			self.compactInBackground()
+
+	# Every cached entry is also in the log, so an
+	# evicted entry is simply read back when needed
+	def cacheEntry(self, destination_hash, entry):
+		self.entries.pop(destination_hash, None)
+		if KnownDestinations.entry_cache_size > 0:
+			self.entries[destination_hash] = entry
+			while len(self.entries) > KnownDestinations.entry_cache_size:
+				self.entries.popitem(last=False)
+
+	def appendRecord(self, destination_hash, entry):
+		record = umsgpack.packb([destination_hash]+list(entry))
+		offset = self.log_size+KnownDestinations.PREFIX_SIZE
+		self.logfile.write(struct.pack(KnownDestinations.LENGTH_PREFIX, len(record))+record)
+		self.logfile.flush()
+		self.log_size = offset+len(record)
+
+		if destination_hash in self.index:
+			self.live_size -= self.index[destination_hash][1]+KnownDestinations.PREFIX_SIZE
+		self.index[destination_hash] = [offset, len(record), entry[0], entry[0]]
+		self.live_size += len(record)+KnownDestinations.PREFIX_SIZE
+
+	def readRecord(self, offset, length):
+		file = open(self.logpath, "rb")
+		file.seek(offset)
+		data = file.read(length)
+		file.close()
+		return umsgpack.unpackb(data)
+
+	# Loads the saved index, and then replays any
+	# records appended to the log after the index
+	# was written, so nothing is lost if we did not
+	# shut down cleanly.
+	def loadIndex(self):
+		indexed_size = 0
+		if os.path.isfile(self.indexpath):
+			try:
+				file = open(self.indexpath, "rb")
+				saved = umsgpack.load(file)
+				file.close()
+				indexed_size = saved[0]
+				self.index = saved[1]
+			except Exception as e:
+				RNS.log("Could not load known destinations index, rebuilding it from the log", RNS.LOG_ERROR)
+				indexed_size = 0
+				self.index = {}
+
+		if os.path.isfile(self.logpath):
+			self.log_size = os.path.getsize(self.logpath)
+			if indexed_size > self.log_size:
+				indexed_size = 0
+				self.index = {}
+
+			if indexed_size < self.log_size:
+				self.replayLog(indexed_size)
+		else:
+			self.index = {}
+
+		self.live_size = 0
+		for destination_hash in self.index:
+			self.live_size += self.index[destination_hash][1]+KnownDestinations.PREFIX_SIZE
+
+		RNS.log("Indexed "+str(len(self.index))+" known destinations from storage", RNS.LOG_VERBOSE)
+
+	def replayLog(self, offset):
+		file = open(self.logpath, "rb")
+		file.seek(offset)
+		replayed = 0
+		while True:
+			prefix = file.read(KnownDestinations.PREFIX_SIZE)
+			if len(prefix) < KnownDestinations.PREFIX_SIZE:
+				break
+			length = struct.unpack(KnownDestinations.LENGTH_PREFIX, prefix)[0]
+			data = file.read(length)
+			if len(data) < length:
+				break
+			try:
+				record = umsgpack.unpackb(data)
+				self.index[record[0]] = [offset+KnownDestinations.PREFIX_SIZE, length, record[1], record[1]]
+				replayed += 1
+			except:
+				break
+			offset += KnownDestinations.PREFIX_SIZE+length
+		file.close()
+
+		# Anything after the last complete record is
+		# a partial write, and is cut off here
+		if offset < self.log_size:
+			RNS.log("Truncating partial record at the end of the known destinations log", RNS.LOG_WARNING)
+			file = open(self.logpath, "r+b")
+			file.truncate(offset)
+			file.close()
+			self.log_size = offset
+
+		if replayed > 0:
+			RNS.log("Replayed "+str(replayed)+" entries from the known destinations log", RNS.LOG_VERBOSE)
+
+	def saveIndex(self):
+		with self.lock:
+			tmppath = self.indexpath+".tmp"
+			file = open(tmppath, "wb")
+			umsgpack.dump([self.log_size, self.index], file)
+			file.close()
+			os.rename(tmppath, self.indexpath)
+
+	def migrateLegacy(self):
+		try:
+			file = open(self.legacypath, "rb")
+			legacy_destinations = umsgpack.load(file)
+			file.close()
+			with self.lock:
+				for destination_hash in legacy_destinations:
+					if not destination_hash in self.index:
+						self.appendRecord(destination_hash, legacy_destinations[destination_hash])
+			self.saveIndex()
+			os.unlink(self.legacypath)
+			RNS.log("Migrated "+str(len(legacy_destinations))+" known destinations to the new storage format", RNS.LOG_NOTICE)
+		except Exception as e:
+			RNS.log("Could not migrate known destinations from "+self.legacypath+". The contained exception was: "+str(e), RNS.LOG_ERROR)
+
+	def hasExpired(self):
+		if KnownDestinations.max_age > 0:
+			now = time.time()
+			for destination_hash in self.index:
+				if now - self.index[destination_hash][2] > KnownDestinations.max_age:
+					return True
+		return False
+
+	def shouldCompact(self):
+		if self.compacting:
+			return False
+		if self.log_size < KnownDestinations.COMPACT_MIN_SIZE:
+			return False
+		return self.log_size > self.live_size*KnownDestinations.COMPACT_RATIO
+
+	def compactInBackground(self):
+		self.compacting = True
+		thread = threading.Thread(target=self.compact)
+		thread.setDaemon(True)
+		thread.start()
+
+	# Rewrites the log with only the latest record
+	# for each destination, leaving out destinations
+	# that have not been heard for longer than max_age
+	def compact(self):
+		self.compacting = True
+		try:
+			with self.lock:
+				now = time.time()
+				tmppath = self.logpath+".tmp"
+				source = open(self.logpath, "rb")
+				target = open(tmppath, "wb")
+				index = {}
+				evicted = 0
+				offset = 0
+				for destination_hash in self.index:
+					old_offset, length, last_heard, written_at = self.index[destination_hash]
+					if KnownDestinations.max_age > 0 and now - last_heard > KnownDestinations.max_age:
+						self.entries.pop(destination_hash, None)
+						evicted += 1
+						continue
+
+					source.seek(old_offset)
+					record = source.read(length)
+					target.write(struct.pack(KnownDestinations.LENGTH_PREFIX, length)+record)
+					index[destination_hash] = [offset+KnownDestinations.PREFIX_SIZE, length, last_heard, written_at]
+					offset += KnownDestinations.PREFIX_SIZE+length
+
+				source.close()
+				target.close()
+				self.logfile.close()
+				os.rename(tmppath, self.logpath)
+				self.logfile = open(self.logpath, "ab")
+
+				self.index = index
+				self.log_size = offset
+				self.live_size = offset
+				self.saveIndex()
+
+			RNS.log("Compacted known destinations log, "+str(len(index))+" entries kept and "+str(evicted)+" evicted", RNS.LOG_VERBOSE)
+		except Exception as e:
+			RNS.log("Error while compacting known destinations log. The contained exception was: "+str(e), RNS.LOG_ERROR)
+		finally:
+			self.compacting = False
+
+	def close(self):
+		with self.lock:
+			self.saveIndex()
+			self.logfile.close()
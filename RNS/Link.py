@@ -4,9 +4,13 @@ from cryptography.hazmat.primitives import serialization
 from cryptography.hazmat.primitives.asymmetric import ec
 from cryptography.hazmat.primitives.kdf.hkdf import HKDF
 from cryptography.fernet import Fernet
+from cryptography.exceptions import InvalidTag
 from time import sleep
 import vendor.umsgpack as umsgpack
 import threading
+import itertools
+import hmac
+import struct
 import base64
 import time
 import RNS
@@ -48,6 +52,46 @@ class Link:
 	ACCEPT_ALL = 0x02
 	resource_strategies = [ACCEPT_NONE, ACCEPT_APP, ACCEPT_ALL]
 
+	# Link capability flags. The receiving end offers
+	# its flags after the signature in the link proof,
+	# and the initiator confirms the ones both ends
+	# support in the RTT packet. The MTU of the path
+	# is discovered the same way, with each end
+	# lowering it to what its own interface supports.
+	FLAG_COMPACT_HEADERS = 0x01
+	FLAG_AEAD            = 0x02
+
+	# When both ends support it, link packets are
+	# encrypted with AES-GCM instead of Fernet. Each
+	# packet carries an 8 byte message counter, which
+	# together with a prefix for the sending direction
+	# makes up the nonce, and a 16 byte tag.
+	AEAD_COUNTERSIZE = 8
+	AEAD_TAGSIZE     = 16
+	AEAD_OVERHEAD    = AEAD_COUNTERSIZE+AEAD_TAGSIZE
+	AEAD_INITIATOR   = "\x01\x00\x00\x00"
+	AEAD_RECEIVER    = "\x02\x00\x00\x00"
+
+	# With FLAG_ACKS, proved packets are acknowledged
+	# in batches instead of with one signed proof each.
+	# Acks are collected for up to ACK_DELAY seconds,
+	# and sent as a list of truncated packet hashes
+	# followed by an HMAC with a key derived from the
+	# link key.
+	FLAG_ACKS      = 0x04
+	ACK_DELAY      = 0.1
+	ACK_HASHLENGTH = 16
+	ACK_MACLENGTH  = 32
+
+	# With FLAG_MESSAGES, small messages sent with
+	# send_message() are held for up to the link's
+	# aggregation delay, and then sent together in
+	# one packet, each prefixed with its length.
+	FLAG_MESSAGES     = 0x08
+	AGGREGATION_DELAY = 0.1
+	MESSAGE_PREFIX    = "!H"
+	MESSAGE_PREFIXSIZE = struct.calcsize(MESSAGE_PREFIX)
+
 	@staticmethod
 	def validateRequest(owner, data, packet):
 		if len(data) == (Link.ECPUBSIZE):
@@ -58,9 +102,11 @@ class Link:
 				RNS.log("Validating link request "+RNS.prettyhexrep(link.link_id), RNS.LOG_VERBOSE)
 				link.handshake()
 				link.attached_interface = packet.receiving_interface
-				link.prove()
+				# The link is registered before the proof is
+				# sent, so it is known when the RTT arrives
 				link.request_time = time.time()
 				RNS.Transport.registerLink(link)
+				link.prove()
 				link.last_inbound = time.time()
 				link.start_watchdog()
 
@@ -106,13 +152,30 @@ class Link:
 		self.owner = owner
 		self.destination = destination
 		self.attached_interface = None
+		self.header_templates = {}
+		self.flags = 0x00
+		self.offered_flags = 0x00
+		self.signalling = None
+		self.compact_id = None
+		self.compact_headers = False
+		self.mtu = RNS.Reticulum.MTU
+		self.mdu = RNS.Reticulum.LINK_MDU
+		self.aead_key = None
+		self.aead_counter = itertools.count()
+		self.ack_key = None
+		self.pending_acks = []
+		self.ack_lock = threading.Lock()
+		self.aggregation_delay = Link.AGGREGATION_DELAY
+		self.pending_messages = []
+		self.pending_size = 0
+		self.message_lock = threading.Lock()
 		self.__encryption_disabled = False
 		if self.destination == None:
 			self.initiator = False
 		else:
 			self.initiator = True
 		
-		self.prv = ec.generate_private_key(Link.CURVE, default_backend())
+		self.prv = RNS.KeyPool.getLinkKey()
 		self.pub = self.prv.public_key()
 		self.pub_bytes = self.pub.public_bytes(
 			encoding=serialization.Encoding.DER,
@@ -147,6 +210,83 @@ class Link:
 		self.link_id = RNS.Identity.truncatedHash(packet.raw)
 		self.hash = self.link_id
 
+	# Returns the capability flags this end can offer
+	# for the link, reserving any resources they need
+	def getLocalFlags(self):
+		flags = 0x00
+		if self.attached_interface != None and self.attached_interface.compact_headers:
+			self.compact_id = self.link_id[:RNS.Packet.COMPACT_ADDRESS_LENGTH]
+			if RNS.Transport.registerCompactLink(self):
+				flags |= Link.FLAG_COMPACT_HEADERS
+			else:
+				RNS.log("Compact address of "+str(self)+" is in use by another link, using full headers", RNS.LOG_DEBUG)
+				self.compact_id = None
+
+		if RNS.Reticulum.should_use_link_aead():
+			flags |= Link.FLAG_AEAD
+
+		if RNS.Reticulum.should_use_link_acks():
+			flags |= Link.FLAG_ACKS
+
+		# Splitting aggregated messages costs nothing
+		# unless the peer uses it, so it is always offered
+		flags |= Link.FLAG_MESSAGES
+
+		return flags
+
+	# Returns the largest MTU this end of the link
+	# can support on the interface it is attached to
+	def getLocalMTU(self):
+		if self.attached_interface != None:
+			return self.attached_interface.MTU
+		else:
+			return RNS.Reticulum.MTU
+
+	def applyMTU(self, mtu):
+		if mtu != self.mtu:
+			self.mtu = mtu
+			self.updateMDU()
+			self.header_templates = {}
+			RNS.log("Link "+str(self)+" MTU is "+str(self.mtu)+" bytes", RNS.LOG_VERBOSE)
+
+	def updateMDU(self):
+		if self.aead_key != None:
+			self.mdu = self.mtu - RNS.Reticulum.HEADER_MAXSIZE - Link.AEAD_OVERHEAD
+		else:
+			self.mdu = self.mtu - RNS.Reticulum.HEADER_MAXSIZE - RNS.Reticulum.PAD_AES_HMAC
+
+	# Puts the capability flags agreed on by both ends
+	# of the link into effect
+	def applyFlags(self, flags):
+		self.flags = flags
+		if self.flags & Link.FLAG_COMPACT_HEADERS:
+			self.compact_headers = True
+			RNS.log("Link "+str(self)+" is using compact headers", RNS.LOG_VERBOSE)
+		elif self.compact_id != None:
+			RNS.Transport.deregisterCompactLink(self)
+			self.compact_id = None
+
+		if self.flags & Link.FLAG_AEAD:
+			self.aead_key = HKDF(
+				algorithm=hashes.SHA256(),
+				length=32,
+				salt=self.getSalt(),
+				info="link aead",
+				backend=default_backend()
+			).derive(self.shared_key)
+			self.updateMDU()
+			RNS.log("Link "+str(self)+" is using AEAD encryption", RNS.LOG_VERBOSE)
+
+		if self.flags & Link.FLAG_ACKS:
+			self.ack_key = HKDF(
+				algorithm=hashes.SHA256(),
+				length=32,
+				salt=self.getSalt(),
+				info="link ack",
+				backend=default_backend()
+			).derive(self.shared_key)
+			RNS.log("Link "+str(self)+" is using batched acknowledgements", RNS.LOG_VERBOSE)
+
 	def handshake(self):
 		self.status = Link.HANDSHAKE
 		self.shared_key = self.prv.exchange(ec.ECDH(), self.peer_pub)
@@ -162,11 +302,17 @@ class Link:
 		signed_data = self.link_id+self.pub_bytes
 		signature = self.owner.identity.sign(signed_data)
 
-		proof_data = self.pub_bytes+signature
+		self.offered_flags = self.getLocalFlags()
+		self.signalling = chr(self.offered_flags)+struct.pack("!H", self.getLocalMTU())
+		proof_data = self.pub_bytes+signature+self.signalling
 		proof = RNS.Packet(self, proof_data, packet_type=RNS.Packet.PROOF, context=RNS.Packet.LRPROOF)
 		proof.send()
 
 	def prove_packet(self, packet):
+		if self.ack_key != None:
+			self.queueAck(packet.packet_hash)
+			return
+
 		signature = self.sign(packet.packet_hash)
 		# TODO: Hardcoded as explicit proof for now
 		# if RNS.Reticulum.should_use_implicit_proof():
@@ -178,11 +324,63 @@ class Link:
 		proof = RNS.Packet(self, proof_data, RNS.Packet.PROOF)
 		proof.send()
 
+	def queueAck(self, packet_hash):
+		with self.ack_lock:
+			self.pending_acks.append(packet_hash[:Link.ACK_HASHLENGTH])
+			if len(self.pending_acks) == 1:
+				RNS.Scheduler.schedule(Link.ACK_DELAY, RNS.Scheduler.dispatch, self.flushAcks)
+			ack_list_full = len(self.pending_acks) >= self.getMaxAcks()
+
+		if ack_list_full:
+			self.flushAcks()
+
+	def flushAcks(self):
+		with self.ack_lock:
+			acks = self.pending_acks
+			self.pending_acks = []
+
+		if self.status == Link.CLOSED:
+			return
+
+		max_acks = self.getMaxAcks()
+		for i in range(0, len(acks), max_acks):
+			acked_hashes = "".join(acks[i:i+max_acks])
+			ack_data = acked_hashes+self.getAckMAC(acked_hashes)
+			ack = RNS.Packet(self, ack_data, packet_type=RNS.Packet.PROOF, context=RNS.Packet.LINKPROOF)
+			ack.send()
+
+	# Acks are not encrypted, so the whole space
+	# after the header is available for them
+	def getMaxAcks(self):
+		return (self.mtu - RNS.Reticulum.HEADER_MAXSIZE - Link.ACK_MACLENGTH)/Link.ACK_HASHLENGTH
+
+	def getAckMAC(self, acked_hashes):
+		return RNS.CryptoProvider.get().hmac(self.ack_key, chr(RNS.Packet.LINKPROOF)+acked_hashes)
+
+	# Returns the list of packet hashes covered by
+	# an ack, or None if it is not valid
+	def validateAcks(self, ack_data):
+		if self.ack_key == None:
+			return None
+
+		acked_hashes = ack_data[:-Link.ACK_MACLENGTH]
+		mac = ack_data[-Link.ACK_MACLENGTH:]
+		if len(acked_hashes) == 0 or len(acked_hashes) % Link.ACK_HASHLENGTH != 0:
+			return None
+
+		if not hmac.compare_digest(mac, self.getAckMAC(acked_hashes)):
+			RNS.log("Invalid ack received on "+str(self), RNS.LOG_DEBUG)
+			return None
+
+		return [acked_hashes[i:i+Link.ACK_HASHLENGTH] for i in range(0, len(acked_hashes), Link.ACK_HASHLENGTH)]
+
 	def validateProof(self, packet):
 		if self.initiator:
 			peer_pub_bytes = packet.data[:Link.ECPUBSIZE]
+			siglength = self.destination.identity.getSigLength()/8
+			signature = packet.data[Link.ECPUBSIZE:siglength+Link.ECPUBSIZE]
+			signalling = packet.data[siglength+Link.ECPUBSIZE:]
 			signed_data = self.link_id+peer_pub_bytes
-			signature = packet.data[Link.ECPUBSIZE:RNS.Identity.KEYSIZE/8+Link.ECPUBSIZE]
 
 			if self.destination.identity.validate(signature, signed_data):
 				self.loadPeer(peer_pub_bytes)
@@ -191,10 +389,28 @@ class Link:
 				self.attached_interface = packet.receiving_interface
 				RNS.Transport.activateLink(self)
 				RNS.log("Link "+str(self)+" established with "+str(self.destination)+", RTT is "+str(self.rtt), RNS.LOG_VERBOSE)
-				rtt_data = umsgpack.packb(self.rtt)
+
+				# Destinations that do not negotiate capability
+				# flags expect only the RTT in return. The
+				# signalling is not covered by the proof
+				# signature, so it is echoed back in the
+				# encrypted RTT packet, where the destination
+				# can check that it was not altered on the way.
+				if len(signalling) > 0:
+					peer_flags = ord(signalling[0])
+					peer_mtu = struct.unpack("!H", signalling[1:3])[0] if len(signalling) > 2 else RNS.Reticulum.MTU
+					flags = self.getLocalFlags() & peer_flags
+					mtu = min(peer_mtu, self.getLocalMTU())
+					rtt_data = umsgpack.packb([self.rtt, flags, mtu, signalling])
+				else:
+					flags = 0x00
+					mtu = RNS.Reticulum.MTU
+					rtt_data = umsgpack.packb(self.rtt)
 				rtt_packet = RNS.Packet(self, rtt_data, context=RNS.Packet.LRRTT)
 				RNS.log("Sending RTT packet", RNS.LOG_EXTREME);
 				rtt_packet.send()
+				self.applyFlags(flags)
+				self.applyMTU(mtu)
 
 				self.status = Link.ACTIVE
 				if self.callbacks.link_established != None:
@@ -215,8 +431,29 @@ class Link:
 			# for now though.
 			measured_rtt = time.time() - self.request_time
 			plaintext = self.decrypt(packet.data)
-			rtt = umsgpack.unpackb(plaintext)
+			rtt_data = umsgpack.unpackb(plaintext)
+
+			# Initiators that do not negotiate capability
+			# flags send only the RTT. Initiators that do
+			# echo the signalling they received, which
+			# must match what was sent in the proof.
+			if isinstance(rtt_data, list):
+				if len(rtt_data) < 4 or rtt_data[3] != self.signalling:
+					RNS.log("Link signalling for "+str(self)+" was altered in transit, tearing down link", RNS.LOG_ERROR)
+					self.teardown()
+					return
+
+				rtt = rtt_data[0]
+				flags = rtt_data[1] & self.offered_flags
+				mtu = min(rtt_data[2], self.getLocalMTU())
+			else:
+				rtt = rtt_data
+				flags = 0x00
+				mtu = RNS.Reticulum.MTU
+
 			self.rtt = max(measured_rtt, rtt)
+			self.applyFlags(flags)
+			self.applyMTU(mtu)
 			self.status = Link.ACTIVE
 			# TODO: Link established callback moved here, ok?
 			if self.owner.callbacks.link_established != None:
@@ -234,6 +471,7 @@ class Link:
 
 	def teardown(self):
 		if self.status != Link.PENDING and self.status != Link.CLOSED:
+			self.flush()
 			teardown_packet = RNS.Packet(self, self.link_id, context=RNS.Packet.LINKCLOSE)
 			teardown_packet.send()
 		self.status = Link.CLOSED
@@ -262,72 +500,142 @@ class Link:
 		for resource in self.outgoing_resources:
 			resource.cancel()
 			
+		if self.compact_id != None:
+			RNS.Transport.deregisterCompactLink(self)
+			self.compact_headers = False
+
 		self.prv = None
 		self.pub = None
 		self.pub_bytes = None
 		self.shared_key = None
 		self.derived_key = None
+		self.aead_key = None
+		self.ack_key = None
 
 		if self.callbacks.link_closed != None:
-			self.callbacks.link_closed(self)
+			RNS.Scheduler.dispatch(self.callbacks.link_closed, self)
 
 	def start_watchdog(self):
-		thread = threading.Thread(target=self.__watchdog_job)
-		thread.setDaemon(True)
-		thread.start()
+		RNS.Scheduler.schedule(0, self.__watchdog_job)
 
+	# Runs one check of the link state on the
+	# scheduler thread, and schedules the next
+	# check for when something can change
 	def __watchdog_job(self):
-		while not self.status == Link.CLOSED:
-			while (self.watchdog_lock):
-				sleep(max(self.rtt, 0.025))
-
-			if not self.status == Link.CLOSED:
-				# Link was initiated, but no response
-				# from destination yet
-				if self.status == Link.PENDING:
-					next_check = self.request_time + self.proof_timeout
-					sleep_time = next_check - time.time()
-					if time.time() >= self.request_time + self.proof_timeout:
-						RNS.log("Link establishment timed out", RNS.LOG_VERBOSE)
-						self.status = Link.CLOSED
-						self.teardown_reason = Link.TIMEOUT
-						self.link_closed()
-						sleep_time = 0.001
-
-				elif self.status == Link.HANDSHAKE:
-					next_check = self.request_time + self.proof_timeout
-					sleep_time = next_check - time.time()
-					if time.time() >= self.request_time + self.proof_timeout:
-						RNS.log("Timeout waiting for RTT packet from link initiator", RNS.LOG_DEBUG)
-						self.status = Link.CLOSED
-						self.teardown_reason = Link.TIMEOUT
-						self.link_closed()
-						sleep_time = 0.001
-
-				elif self.status == Link.ACTIVE:
-					if time.time() >= self.last_inbound + self.keepalive:
-						sleep_time = self.rtt * self.timeout_factor
-						self.status = Link.STALE
-						if self.initiator:
-							self.send_keepalive()
-					else:
-						sleep_time = (self.last_inbound + self.keepalive) - time.time()
-
-				elif self.status == Link.STALE:
-					sleep_time = 0.001
-					self.status = Link.CLOSED
-					self.teardown_reason = Link.TIMEOUT
-					self.link_closed()
-
-
-				if sleep_time == 0:
-					RNS.log("Warning! Link watchdog sleep time of 0!", RNS.LOG_ERROR)
-				if sleep_time == None or sleep_time < 0:
-					RNS.log("Timing error! Closing Reticulum now.", RNS.LOG_CRITICAL)
-					RNS.panic()
-
-				sleep(sleep_time)
+		if self.status == Link.CLOSED:
+			return
+
+		if self.watchdog_lock:
+			RNS.Scheduler.schedule(max(self.rtt, 0.025), self.__watchdog_job)
+			return
+
+		sleep_time = None
+
+		# Link was initiated, but no response
+		# from destination yet
+		if self.status == Link.PENDING:
+			next_check = self.request_time + self.proof_timeout
+			sleep_time = next_check - time.time()
+			if time.time() >= self.request_time + self.proof_timeout:
+				RNS.log("Link establishment timed out", RNS.LOG_VERBOSE)
+				self.status = Link.CLOSED
+				self.teardown_reason = Link.TIMEOUT
+				self.link_closed()
+				sleep_time = 0.001
+
+		elif self.status == Link.HANDSHAKE:
+			next_check = self.request_time + self.proof_timeout
+			sleep_time = next_check - time.time()
+			if time.time() >= self.request_time + self.proof_timeout:
+				RNS.log("Timeout waiting for RTT packet from link initiator", RNS.LOG_DEBUG)
+				self.status = Link.CLOSED
+				self.teardown_reason = Link.TIMEOUT
+				self.link_closed()
+				sleep_time = 0.001
+
+		elif self.status == Link.ACTIVE:
+			if time.time() >= self.last_inbound + self.keepalive:
+				sleep_time = self.rtt * self.timeout_factor
+				self.status = Link.STALE
+
+				# If nothing has been heard for a while, the
+				# peer may have lost its compact address map,
+				# so we fall back to full headers
+				if self.compact_headers:
+					RNS.log("Link "+str(self)+" went stale, falling back to full headers", RNS.LOG_VERBOSE)
+					self.compact_headers = False
+				if self.initiator:
+					RNS.Scheduler.dispatch(self.send_keepalive)
+			else:
+				sleep_time = (self.last_inbound + self.keepalive) - time.time()
+
+		elif self.status == Link.STALE:
+			sleep_time = 0.001
+			self.status = Link.CLOSED
+			self.teardown_reason = Link.TIMEOUT
+			self.link_closed()
+
+
+		if sleep_time == 0:
+			RNS.log("Warning! Link watchdog sleep time of 0!", RNS.LOG_ERROR)
+		if sleep_time == None or sleep_time < 0:
+			RNS.log("Timing error! Closing Reticulum now.", RNS.LOG_CRITICAL)
+			RNS.panic()
+
+		if not self.status == Link.CLOSED:
+			RNS.Scheduler.schedule(sleep_time, self.__watchdog_job)
+
+
+	# Sends a message over the link. If the peer
+	# supports it, small messages are held back for
+	# up to the aggregation delay, so several of them
+	# can share one packet. Urgent messages are sent
+	# right away, together with anything held back.
+	# Returns the receipt of the packet when the
+	# message is sent right away, and None when it
+	# is held back.
+	def send_message(self, data, urgent=False):
+		message_size = Link.MESSAGE_PREFIXSIZE+len(data)
+		if not self.flags & Link.FLAG_MESSAGES or message_size > self.mdu:
+			self.flush()
+			return RNS.Packet(self, data).send()
+
+		with self.message_lock:
+			if self.pending_size+message_size > self.mdu:
+				self.flushMessages()
+
+			self.pending_messages.append(data)
+			self.pending_size += message_size
+			if urgent:
+				return self.flushMessages()
+			elif len(self.pending_messages) == 1:
+				RNS.Scheduler.schedule(self.aggregation_delay, RNS.Scheduler.dispatch, self.flush)
 
+		return None
+
+	# Sends any messages that are held back, and
+	# returns the receipt of the packet they went
+	# out in, or None if there was nothing to send
+	def flush(self):
+		with self.message_lock:
+			return self.flushMessages()
+
+	def flushMessages(self):
+		messages = self.pending_messages
+		self.pending_messages = []
+		self.pending_size = 0
+
+		if len(messages) == 0 or self.status == Link.CLOSED:
+			return None
+
+		if len(messages) == 1:
+			return RNS.Packet(self, messages[0]).send()
+		else:
+			data = "".join([struct.pack(Link.MESSAGE_PREFIX, len(message))+message for message in messages])
+			return RNS.Packet(self, data, context=RNS.Packet.MESSAGES).send()
+
+	def set_aggregation_delay(self, delay):
+		self.aggregation_delay = delay
 
 	def send_keepalive(self):
 		keepalive_packet = RNS.Packet(self, chr(0xFF), context=RNS.Packet.KEEPALIVE)
@@ -358,6 +666,23 @@ class Link:
 							if self.destination.callbacks.proof_requested:
 								self.destination.callbacks.proof_requested(packet)
 
+					elif packet.context == RNS.Packet.MESSAGES:
+						plaintext = self.decrypt(packet.data)
+						if self.callbacks.packet != None:
+							offset = 0
+							while offset+Link.MESSAGE_PREFIXSIZE <= len(plaintext):
+								length = struct.unpack(Link.MESSAGE_PREFIX, plaintext[offset:offset+Link.MESSAGE_PREFIXSIZE])[0]
+								offset += Link.MESSAGE_PREFIXSIZE
+								self.callbacks.packet(plaintext[offset:offset+length], packet)
+								offset += length
+
+						if self.destination.proof_strategy == RNS.Destination.PROVE_ALL:
+							packet.prove()
+
+						elif self.destination.proof_strategy == RNS.Destination.PROVE_APP:
+							if self.destination.callbacks.proof_requested:
+								self.destination.callbacks.proof_requested(packet)
+
 					elif packet.context == RNS.Packet.LRRTT:
 						if not self.initiator:
 							self.rtt_packet(packet)
@@ -427,8 +752,12 @@ class Link:
 		if self.__encryption_disabled:
 			return plaintext
 		try:
-			fernet = Fernet(base64.urlsafe_b64encode(self.derived_key))
-			ciphertext = base64.urlsafe_b64decode(fernet.encrypt(plaintext))
+			if self.aead_key != None:
+				counter = struct.pack("!Q", next(self.aead_counter))
+				nonce = self.getAEADPrefix(self.initiator)+counter
+				return counter+RNS.CryptoProvider.get().aead(self.aead_key).encrypt(nonce, plaintext, None)
+
+			ciphertext = RNS.CryptoProvider.get().fernetEncrypt(self.derived_key, plaintext)
 			return ciphertext
 		except Exception as e:
 			RNS.log("Encryption on link "+str(self)+" failed. The contained exception was: "+str(e), RNS.LOG_ERROR)
@@ -438,19 +767,33 @@ class Link:
 		if self.__encryption_disabled:
 			return ciphertext
 		try:
-			fernet = Fernet(base64.urlsafe_b64encode(self.derived_key))
-			plaintext = fernet.decrypt(base64.urlsafe_b64encode(ciphertext))
+			if self.aead_key != None:
+				try:
+					nonce = self.getAEADPrefix(not self.initiator)+ciphertext[:Link.AEAD_COUNTERSIZE]
+					return RNS.CryptoProvider.get().aead(self.aead_key).decrypt(nonce, ciphertext[Link.AEAD_COUNTERSIZE:], None)
+				except InvalidTag:
+					# Packets sent before the peer switched
+					# to AEAD are still Fernet tokens
+					pass
+
+			plaintext = RNS.CryptoProvider.get().fernetDecrypt(self.derived_key, ciphertext)
 			return plaintext
 		except Exception as e:
 			RNS.log("Decryption failed on link "+str(self)+". The contained exception was: "+str(e), RNS.LOG_ERROR)
 			traceback.print_exc()
 
+	def getAEADPrefix(self, from_initiator):
+		if from_initiator:
+			return Link.AEAD_INITIATOR
+		else:
+			return Link.AEAD_RECEIVER
+
 	def sign(self, message):
-		return self.prv.sign(message, ec.ECDSA(hashes.SHA256()))
+		return self.prv.sign(message, RNS.CryptoProvider.get().ecdsa())
 
 	def validate(self, signature, message):
 		try:
-			self.peer_pub.verify(signature, message, ec.ECDSA(hashes.SHA256()))
+			self.peer_pub.verify(signature, message, RNS.CryptoProvider.get().ecdsa())
 			return True
 		except Exception as e:
 			return False
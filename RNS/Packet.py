@@ -1,8 +1,40 @@
-import struct
+import hashlib
 import time
 import RNS
 
-class Packet:
+class Packet(object):
+	# Packets are kept in slots rather than in a per-instance
+	# dict, since resources hold one packed packet per part
+	# for the whole duration of a transfer.
+	__slots__ = (
+		"header_type",			# Header type, one of header_types
+		"packet_type",			# Packet type, one of types
+		"transport_type",		# Transport type, one of Transport.types
+		"destination_type",		# Destination type, set when unpacked
+		"context",				# Context byte
+		"flags",				# Packed flags byte
+		"hops",					# Hop count
+		"destination",			# Destination, Link or ProofDestination
+		"destination_hash",		# Destination hash, set when unpacked
+		"transport_id",			# Transport ID for header type 2
+		"data",					# Payload as a string
+		"data_view",			# Payload as a memoryview, set when unpacked
+		"plaintext",			# Decrypted payload, if it was stored
+		"ciphertext",			# Packed payload
+		"raw",					# The packed packet
+		"raw_view",				# Memoryview over raw, set when unpacked
+		"packed",				# Whether raw is current
+		"fromPacked",			# Whether the packet was created from raw
+		"sent",					# Whether the packet has been sent
+		"sent_at",				# When the packet was last sent
+		"receipt",				# PacketReceipt for sent data packets
+		"packet_hash",			# Hash of the packet
+		"MTU",					# Maximum size of raw
+		"receiving_interface",	# Interface a packet was received on
+		"link",					# Link a packet was received on
+		"map_hash",				# Resource map hash for resource parts
+	)
+
 	# Packet types
 	DATA         = 0x00		# Data packets
 	ANNOUNCE     = 0x01		# Announces
@@ -13,7 +45,7 @@ class Packet:
 	# Header types
 	HEADER_1     = 0x00		# Normal header format
 	HEADER_2     = 0x01		# Header format used for link packets in transport
-	HEADER_3     = 0x02		# Reserved
+	HEADER_3     = 0x02		# Compact header format used on established links
 	HEADER_4     = 0x03		# Reserved
 	header_types = [HEADER_1, HEADER_2, HEADER_3, HEADER_4]
 
@@ -31,6 +63,8 @@ class Packet:
 	RESPONSE       = 0x0A	# Packet is a response to a request
 	COMMAND        = 0x0B	# Packet is a command
 	COMMAND_STATUS = 0x0C	# Packet is a status of an executed command
+	PROOF_AGGREGATE = 0x0D	# Packet is a proof covering several packets
+	MESSAGES       = 0x0E	# Packet carries several link messages
 	KEEPALIVE      = 0xFB	# Packet is a keepalive packet
 	LINKCLOSE      = 0xFC	# Packet is a link close message
 	LINKPROOF      = 0xFD	# Packet is a link packet proof
@@ -41,17 +75,39 @@ class Packet:
 	# payload sizes
 	HEADER_MAXSIZE = RNS.Reticulum.HEADER_MAXSIZE
 
+	# Length of the short link address carried
+	# in compact headers instead of the link ID.
+	# Other nodes on a shared channel can not see
+	# which addresses are in use locally, so it is
+	# long enough to make collisions unlikely.
+	COMPACT_ADDRESS_LENGTH = 4
+
+	# Packets with these contexts are always sent
+	# with full headers, so a link can still be
+	# identified, kept alive and closed even if
+	# the peer has lost its compact address map
+	full_header_contexts = [KEEPALIVE, LINKCLOSE, LRRTT, LRPROOF]
+
 	# TODO: This should be calculated
 	# more intelligently
 
 	# Default packet timeout
 	TIMEOUT 	 = 60
 
+	# Header fields and payload of a received packet
+	# are only decoded from the raw bytes on first access
+	lazy_fields  = ["transport_id", "destination_hash", "context", "data", "data_view"]
+
 	def __init__(self, destination, data, packet_type = DATA, context = NONE, transport_type = RNS.Transport.BROADCAST, header_type = HEADER_1, transport_id = None):
 		if destination != None:
 			if transport_type == None:
 				transport_type = RNS.Transport.BROADCAST
 
+			if header_type == Packet.HEADER_1 and destination.type == RNS.Destination.LINK:
+				if hasattr(destination, "compact_headers") and destination.compact_headers:
+					if not context in Packet.full_header_contexts:
+						header_type = Packet.HEADER_3
+
 			self.header_type    = header_type
 			self.packet_type    = packet_type
 			self.transport_type = transport_type
@@ -69,11 +125,23 @@ class Packet:
 			self.receipt 		= None
 			self.fromPacked		= False
 		else:
+			self.destination    = None
 			self.raw            = data
 			self.packed         = True
 			self.fromPacked     = True
 
+		self.receiving_interface = None
+		self.link        = None
+		self.plaintext   = None
+		self.map_hash    = None
+
+		self.raw_view    = None
 		self.MTU         = RNS.Reticulum.MTU
+
+		# Links may have discovered a larger
+		# MTU along their path
+		if destination != None and destination.type == RNS.Destination.LINK:
+			self.MTU = destination.mtu
 		self.sent_at     = None
 		self.packet_hash = None
 
@@ -85,97 +153,197 @@ class Packet:
 		return packed_flags
 
 	def pack(self):
-		self.header = ""
-		self.header += struct.pack("!B", self.flags)
-		self.header += struct.pack("!B", self.hops)
+		self.packWithTemplate(self.getHeaderTemplate())
 
+	def packWithTemplate(self, header_template):
+		# The packed bytes are about to change, so any
+		# previously computed hash is no longer valid
+		self.packet_hash = None
 
 		if self.context == Packet.LRPROOF:
-			self.header += self.destination.link_id
+			self.ciphertext = self.data
+		elif self.packet_type == Packet.ANNOUNCE:
+			# Announce packets are not encrypted
+			self.ciphertext = self.data
+		elif self.packet_type == Packet.PROOF and self.context == Packet.RESOURCE_PRF:
+			# Resource proofs are not encrypted
+			self.ciphertext = self.data
+		elif self.packet_type == Packet.PROOF and self.destination.type == RNS.Destination.LINK:
+			# Packet proofs over links are not encrypted
+			self.ciphertext = self.data
+		elif self.context == Packet.RESOURCE:
+			# A resource takes care of symmetric
+			# encryption by itself
+			self.ciphertext = self.data
+		elif self.context == Packet.KEEPALIVE:
+			# Keepalive packets contain no actual
+			# data
 			self.ciphertext = self.data
 		else:
-			if self.header_type == Packet.HEADER_1:
-				self.header += self.destination.hash
-
-				if self.packet_type == Packet.ANNOUNCE:
-					# Announce packets are not encrypted
-					self.ciphertext = self.data
-				elif self.packet_type == Packet.PROOF and self.context == Packet.RESOURCE_PRF:
-					# Resource proofs are not encrypted
-					self.ciphertext = self.data
-				elif self.packet_type == Packet.PROOF and self.destination.type == RNS.Destination.LINK:
-					# Packet proofs over links are not encrypted
-					self.ciphertext = self.data
-				elif self.context == Packet.RESOURCE:
-					# A resource takes care of symmetric
-					# encryption by itself
-					self.ciphertext = self.data
-				elif self.context == Packet.KEEPALIVE:
-					# Keepalive packets contain no actual
-					# data
-					self.ciphertext = self.data
-				else:
-					# In all other cases, we encrypt the packet
-					# with the destination's public key
-					self.ciphertext = self.destination.encrypt(self.data)
-
-			if self.header_type == Packet.HEADER_2:
-				if self.transport_id != None:
-					self.header += self.transport_id
-					self.header += self.destination.hash
-
-					if self.packet_type == Packet.ANNOUNCE:
-						# Announce packets are not encrypted
-						self.ciphertext = self.data
-				else:
-					raise IOError("Packet with header type 2 must have a transport ID")
-
+			# In all other cases, we encrypt the packet
+			# with the destination's public key
+			self.ciphertext = self.destination.encrypt(self.data)
 
+		if len(self.ciphertext) > header_template[2]:
+			packet_size = len(self.ciphertext)+self.MTU-header_template[2]
+			raise IOError("Packet size of "+str(packet_size)+" exceeds MTU of "+str(self.MTU)+" bytes")
 
+		if self.hops == 0:
+			self.raw = header_template[3]+self.ciphertext
+		else:
+			self.raw = header_template[0]+chr(self.hops)+header_template[1]+self.ciphertext
+		self.raw_view = None
+		self.packed = True
 
-		self.header += chr(self.context)
-
-		self.raw = self.header + self.ciphertext
+	# Returns the header template for this packet. Every
+	# header field except the hop count only depends on
+	# the destination, packet type, context, transport
+	# type and transport ID, so destinations and links
+	# keep a template for each combination they have
+	# sent. A template is a tuple of the flags byte, the
+	# address fields and context byte that follow the hop
+	# count, the maximum ciphertext size that fits within
+	# the MTU, and the complete header for a hop count of
+	# zero, which is what almost every packet we originate
+	# is sent with.
+	def getHeaderTemplate(self):
+		key = (self.header_type, self.packet_type, self.context, self.transport_type, self.transport_id)
+		try:
+			return self.destination.header_templates[key]
+		except KeyError:
+			header_template = self.buildHeaderTemplate()
+			self.destination.header_templates[key] = header_template
+			return header_template
+		except AttributeError:
+			return self.buildHeaderTemplate()
+
+	def buildHeaderTemplate(self):
+		if self.context == Packet.LRPROOF:
+			address = self.destination.link_id
+		elif self.header_type == Packet.HEADER_3:
+			address = self.destination.compact_id
+		elif self.header_type == Packet.HEADER_2:
+			if self.transport_id != None:
+				address = self.transport_id+self.destination.hash
+			else:
+				raise IOError("Packet with header type 2 must have a transport ID")
+		else:
+			address = self.destination.hash
 
-		if len(self.raw) > self.MTU:
-			raise IOError("Packet size of "+str(len(self.raw))+" exceeds MTU of "+str(self.MTU)+" bytes")
+		header_tail = address+chr(self.context)
+		max_ciphertext = self.MTU-2-len(header_tail)
 
-		self.packed = True
+		return (chr(self.flags), header_tail, max_ciphertext, chr(self.flags)+chr(0)+header_tail)
 
 	def unpack(self):
-		self.flags = ord(self.raw[0])
-		self.hops  = ord(self.raw[1])
+		self.raw_view = memoryview(self.raw)
+		self.flags = ord(self.raw_view[0])
+		self.hops  = ord(self.raw_view[1])
 
 		self.header_type      = (self.flags & 0b11000000) >> 6
 		self.transport_type   = (self.flags & 0b00110000) >> 4
 		self.destination_type = (self.flags & 0b00001100) >> 2
 		self.packet_type      = (self.flags & 0b00000011)
 
+		# The remaining header fields and the payload
+		# are decoded lazily by __getattr__
+		self.packed = False
+
+	def __getattr__(self, name):
+		if name in Packet.lazy_fields and self.raw_view != None:
+			if name == "data":
+				self.data = self.data_view.tobytes()
+			else:
+				self.decodeFields()
+			return getattr(self, name)
+		else:
+			raise AttributeError(name)
+
+	def decodeFields(self):
 		if self.header_type == Packet.HEADER_2:
-			self.transport_id = self.raw[2:12]
-			self.destination_hash = self.raw[12:22]
-			self.context = ord(self.raw[22:23])
-			self.data = self.raw[23:]
+			self.transport_id = self.raw_view[2:12].tobytes()
+			self.destination_hash = self.raw_view[12:22].tobytes()
+			self.context = ord(self.raw_view[22])
+			self.data_view = self.raw_view[23:]
+		elif self.header_type == Packet.HEADER_3:
+			# The compact address is mapped back to the
+			# full link ID by Transport
+			address_end = 2+Packet.COMPACT_ADDRESS_LENGTH
+			self.transport_id = None
+			self.destination_hash = self.raw_view[2:address_end].tobytes()
+			self.context = ord(self.raw_view[address_end])
+			self.data_view = self.raw_view[address_end+1:]
 		else:
 			self.transport_id = None
-			self.destination_hash = self.raw[2:12]
-			self.context = ord(self.raw[12:13])
-			self.data = self.raw[13:]
+			self.destination_hash = self.raw_view[2:12].tobytes()
+			self.context = ord(self.raw_view[12])
+			self.data_view = self.raw_view[13:]
+
+	# Creates and packs a packet for each payload in a
+	# sequence, all addressed to the same destination or
+	# link. The header template is looked up once, and
+	# since every packet then starts with the same
+	# hashable header bytes, the digest of those is
+	# computed once too, and only extended with each
+	# packet's ciphertext.
+	@staticmethod
+	def pack_batch(destination, payloads, packet_type = DATA, context = NONE):
+		packets = []
+		header_template = None
+		header_digest = None
+		for data in payloads:
+			packet = Packet(destination, data, packet_type = packet_type, context = context)
+			if header_template == None:
+				header_template = packet.getHeaderTemplate()
+				header_digest = hashlib.sha256(header_template[0]+header_template[1])
+
+			packet.packWithTemplate(header_template)
+			digest = header_digest.copy()
+			digest.update(packet.ciphertext)
+			packet.packet_hash = digest.digest()
+			packets.append(packet)
+
+		return packets
+
+	# Sends a sequence of packets in a single pass through
+	# Transport. Packets that were already sent are resent.
+	# Returns the packets that could not be sent, which
+	# is an empty list if all of them went out.
+	@staticmethod
+	def send_batch(packets):
+		failed = []
+		ready = []
+		for packet in packets:
+			if packet.sent:
+				ready.append(packet)
+			else:
+				try:
+					packet.prepareSend()
+					ready.append(packet)
+				except Exception as e:
+					RNS.log("Could not prepare packet for sending. The contained exception was: "+str(e), RNS.LOG_DEBUG)
+					failed.append(packet)
+
+		if len(ready) > 0:
+			failed.extend(RNS.Transport.outbound_batch(ready))
+
+		return failed
+
+	def prepareSend(self):
+		if self.destination.type == RNS.Destination.LINK:
+			if self.destination.status == RNS.Link.CLOSED:
+				raise IOError("Attempt to transmit over a closed link")
+			else:
+				self.destination.last_outbound = time.time()
+				self.destination.tx += 1
+				self.destination.txbytes += len(self.data)
 
-		self.packed = False
+		if not self.packed:
+			self.pack()
 
 	def send(self):
 		if not self.sent:
-			if self.destination.type == RNS.Destination.LINK:
-				if self.destination.status == RNS.Link.CLOSED:
-					raise IOError("Attempt to transmit over a closed link")
-				else:
-					self.destination.last_outbound = time.time()
-					self.destination.tx += 1
-					self.destination.txbytes += len(self.data)
-
-			if not self.packed:
-				self.pack()
+			self.prepareSend()
 	
 			if RNS.Transport.outbound(self):
 				return self.receipt
@@ -198,7 +366,10 @@ class Packet:
 	def prove(self, destination=None):
 		if self.fromPacked and hasattr(self, "destination") and self.destination:
 			if self.destination.identity and self.destination.identity.prv:
-				self.destination.identity.prove(self, destination)
+				if destination == None and RNS.Reticulum.should_aggregate_proofs():
+					RNS.Transport.queueProof(self)
+				else:
+					self.destination.identity.prove(self, destination)
 		elif self.fromPacked and hasattr(self, "link") and self.link:
 			self.link.prove_packet(self)
 		else:
@@ -216,17 +387,27 @@ class Packet:
 		return self.receipt.validateProof(proof)
 
 	def updateHash(self):
-		self.packet_hash = self.getHash()
+		self.getHash()
 
+	# The hash is computed once the packed bytes are final,
+	# and cached until the packet is packed again. The hops
+	# byte is not part of the hash, so changing the hop
+	# count does not invalidate it.
 	def getHash(self):
-		return RNS.Identity.fullHash(self.getHashablePart())
+		if self.packet_hash == None:
+			# The hashable part is fed to the digest in two
+			# slices, so it never has to be copied out of raw
+			raw = self.raw_view if self.raw_view != None else memoryview(self.raw)
+			digest = hashlib.sha256()
+			digest.update(raw[0:1])
+			digest.update(raw[2:])
+			self.packet_hash = digest.digest()
+
+		return self.packet_hash
 
-	def getHashablePart(self):
-		# TODO: This assumes transport headers are stripped
-		# by Transport before going anywhere else
-		return self.raw[0:1]+self.raw[2:]
+class ProofDestination(object):
+	__slots__ = ("hash", "type")
 
-class ProofDestination:
 	def __init__(self, packet):
 		self.hash = packet.getHash()[:10];
 		self.type = RNS.Destination.SINGLE
@@ -235,7 +416,11 @@ class ProofDestination:
 		return plaintext
 
 
-class PacketReceipt:
+class PacketReceipt(object):
+	# Receipts are held for every sent data packet until
+	# they are proved or time out, so they use slots too
+	__slots__ = ("hash", "sent", "sent_at", "timeout", "proved", "status", "destination", "callbacks", "concluded_at")
+
 	# Receipt status constants
 	FAILED    = 0x00
 	SENT	  = 0x01
@@ -245,6 +430,10 @@ class PacketReceipt:
 	EXPL_LENGTH = RNS.Identity.HASHLENGTH/8+RNS.Identity.SIGLENGTH/8
 	IMPL_LENGTH = RNS.Identity.SIGLENGTH/8
 
+	CURVE25519_EXPL_LENGTH = RNS.Identity.HASHLENGTH/8+RNS.Identity.CURVE25519_SIGLENGTH/8
+	CURVE25519_IMPL_LENGTH = RNS.Identity.CURVE25519_SIGLENGTH/8
+	explicit_lengths = [EXPL_LENGTH, CURVE25519_EXPL_LENGTH]
+
 	# Creates a new packet receipt from a sent packet
 	def __init__(self, packet):
 		self.hash    = packet.getHash()
@@ -302,12 +491,15 @@ class PacketReceipt:
 		else:
 			return False
 
-	# Validate a raw proof
+	# Validate a raw proof. The length of the
+	# signature depends on the identity type
+	# of the destination.
 	def validateProof(self, proof):
-		if len(proof) == PacketReceipt.EXPL_LENGTH:
+		siglength = self.destination.identity.getSigLength()/8
+		if len(proof) == RNS.Identity.HASHLENGTH/8+siglength:
 			# This is an explicit proof
 			proof_hash = proof[:RNS.Identity.HASHLENGTH/8]
-			signature = proof[RNS.Identity.HASHLENGTH/8:RNS.Identity.HASHLENGTH/8+RNS.Identity.SIGLENGTH/8]
+			signature = proof[RNS.Identity.HASHLENGTH/8:RNS.Identity.HASHLENGTH/8+siglength]
 			if proof_hash == self.hash:
 				proof_valid = self.destination.identity.validate(signature, self.hash)
 				if proof_valid:
@@ -321,9 +513,9 @@ class PacketReceipt:
 					return False
 			else:
 				return False
-		elif len(proof) == PacketReceipt.IMPL_LENGTH:
+		elif len(proof) == siglength:
 			# This is an implicit proof
-			signature = proof[:RNS.Identity.SIGLENGTH/8]
+			signature = proof[:siglength]
 			proof_valid = self.destination.identity.validate(signature, self.hash)
 			if proof_valid:
 					self.status = PacketReceipt.DELIVERED
@@ -337,6 +529,46 @@ class PacketReceipt:
 		else:
 			return False
 
+	# Validate an aggregated proof, which is a list
+	# of truncated packet hashes followed by one
+	# signature over all of them
+	def validateAggregateProof(self, proof):
+		siglength = self.destination.identity.getSigLength()/8
+		hashlength = RNS.Identity.AGGREGATE_HASHLENGTH/8
+		hashes = proof[:-siglength]
+		signature = proof[-siglength:]
+		if len(hashes) == 0 or len(hashes) % hashlength != 0:
+			return False
+
+		proved_hashes = [hashes[i:i+hashlength] for i in range(0, len(hashes), hashlength)]
+		if not self.hash[:hashlength] in proved_hashes:
+			return False
+
+		signed_data = chr(Packet.PROOF_AGGREGATE)+hashes
+		if self.destination.identity.validate(signature, signed_data):
+			self.status = PacketReceipt.DELIVERED
+			self.proved = True
+			self.concluded_at = time.time()
+			if self.callbacks.delivery != None:
+				self.callbacks.delivery(self)
+			return True
+		else:
+			return False
+
+	# Validate a packet hash from a batched link ack.
+	# The ack itself has already been authenticated
+	# by the link it arrived on.
+	def validateLinkAck(self, acked_hash, link):
+		if self.destination == link and self.hash[:len(acked_hash)] == acked_hash:
+			self.status = PacketReceipt.DELIVERED
+			self.proved = True
+			self.concluded_at = time.time()
+			if self.callbacks.delivery != None:
+				self.callbacks.delivery(self)
+			return True
+		else:
+			return False
+
 	def rtt(self):
 		return self.concluded_at - self.sent_at
 
@@ -365,7 +597,9 @@ class PacketReceipt:
 	def timeout_callback(self, callback):
 		self.callbacks.timeout = callback
 
-class PacketReceiptCallbacks:
+class PacketReceiptCallbacks(object):
+	__slots__ = ("delivery", "timeout")
+
 	def __init__(self):
 		self.delivery = None
 		self.timeout  = None
\ No newline at end of file
@@ -11,7 +11,6 @@ class Resource:
 	WINDOW_MAX  = 7
 	WINDOW      = 4
 	MAPHASH_LEN = 4
-	SDU         = RNS.Reticulum.MTU - RNS.Packet.HEADER_MAXSIZE
 	RANDOM_HASH_SIZE = 4
 
 	# TODO: Should be allocated more
@@ -52,7 +51,7 @@ class Resource:
 			resource.initiator           = False
 			resource.callback		     = callback
 			resource.__progress_callback = progress_callback
-			resource.total_parts	     = int(math.ceil(resource.size/float(Resource.SDU)))
+			resource.total_parts	     = adv.n
 			resource.received_count      = 0
 			resource.outstanding_parts   = 0
 			resource.parts			     = [None] * resource.total_parts
@@ -89,6 +88,7 @@ class Resource:
 		self.watchdog_lock = False
 		self.__watchdog_job_id = 0
 		self.rtt = None
+		self.expected_proof_packet_hash = None
 
 		if data != None:
 			hashmap_ok = False
@@ -122,16 +122,18 @@ class Resource:
 
 				self.size = len(self.data)
 				
-				self.hashmap = ""
+				# Parts are sized to fit the MTU
+				# discovered for the link
+				self.sdu = self.link.mtu - RNS.Packet.HEADER_MAXSIZE
 				self.sent_parts = 0
-				self.parts  = []
-				for i in range(0,int(math.ceil(self.size/float(Resource.SDU)))):
-					data = self.data[i*Resource.SDU:(i+1)*Resource.SDU]
-					part = RNS.Packet(link, data, context=RNS.Packet.RESOURCE)
-					part.pack()
-					part.map_hash = self.getMapHash(data)
-					self.hashmap += part.map_hash
-					self.parts.append(part)
+				part_data = []
+				for i in range(0,int(math.ceil(self.size/float(self.sdu)))):
+					part_data.append(self.data[i*self.sdu:(i+1)*self.sdu])
+
+				self.parts = RNS.Packet.pack_batch(link, part_data, context=RNS.Packet.RESOURCE)
+				for part in self.parts:
+					part.map_hash = self.getMapHash(part.data)
+				self.hashmap = "".join([part.map_hash for part in self.parts])
 
 				hashmap_ok = self.checkHashMap()
 				if not hashmap_ok:
@@ -178,18 +180,19 @@ class Resource:
 		return RNS.Identity.fullHash(data+self.random_hash)[:Resource.MAPHASH_LEN]
 
 	def advertise(self):
-		thread = threading.Thread(target=self.__advertise_job)
-		thread.setDaemon(True)
-		thread.start()
-
-	def __advertise_job(self):
 		data = ResourceAdvertisement(self).pack()
 		self.advertisement_packet = RNS.Packet(self.link, data, context=RNS.Packet.RESOURCE_ADV)
-		while not self.link.ready_for_new_resource():
+		RNS.Scheduler.schedule(0, self.__advertise_job)
+
+	# Waits on the scheduler until the link is ready
+	# for a new resource, and then advertises it
+	def __advertise_job(self):
+		if not self.link.ready_for_new_resource():
 			self.status = Resource.QUEUED
-			sleep(0.25)
+			RNS.Scheduler.schedule(0.25, self.__advertise_job)
+			return
 
-		self.advertisement_packet.send()
+		RNS.Scheduler.dispatch(self.advertisement_packet.send)
 		self.last_activity = time.time()
 		self.adv_sent = self.last_activity
 		self.rtt = None
@@ -198,86 +201,88 @@ class Resource:
 
 		self.watchdog_job()
 
+	# Starting the watchdog again supersedes any
+	# check that is already scheduled
 	def watchdog_job(self):
-		thread = threading.Thread(target=self.__watchdog_job)
-		thread.setDaemon(True)
-		thread.start()
-
-	def __watchdog_job(self):
 		self.__watchdog_job_id += 1
-		this_job_id = self.__watchdog_job_id
+		RNS.Scheduler.schedule(0, self.__watchdog_job, self.__watchdog_job_id)
 
-		while self.status < Resource.ASSEMBLING and this_job_id == self.__watchdog_job_id:
-			while self.watchdog_lock:
-				sleep(0.025)
+	def __watchdog_job(self, this_job_id):
+		if not (self.status < Resource.ASSEMBLING and this_job_id == self.__watchdog_job_id):
+			return
 
-			sleep_time = None
+		if self.watchdog_lock:
+			RNS.Scheduler.schedule(0.025, self.__watchdog_job, this_job_id)
+			return
 
-			if self.status == Resource.ADVERTISED:
-				sleep_time = (self.adv_sent+self.default_timeout)-time.time()
-				if sleep_time < 0:
-					if self.retries_left <= 0:
-						RNS.log("Resource transfer timeout after sending advertisement", RNS.LOG_DEBUG)
-						self.cancel()
-						sleep_time = 0.001
-					else:
-						RNS.log("No part requests received, retrying resource advertisement...", RNS.LOG_DEBUG)
-						self.retries_left -= 1
-						self.advertisement_packet.resend()
-						self.last_activity = time.time()
-						self.adv_sent = self.last_activity
-						sleep_time = 0.001
-					
+		sleep_time = None
 
-			elif self.status == Resource.TRANSFERRING:
-				if not self.initiator:
-					rtt = self.link.rtt if self.rtt == None else self.rtt
-					sleep_time = self.last_activity + (rtt*self.timeout_factor) - time.time()
-
-					if sleep_time < 0:
-						if self.retries_left > 0:
-							RNS.log("Timeout waiting for parts, requesting retry", RNS.LOG_DEBUG)
-							sleep_time = 0.001
-							self.retries_left -= 1
-							self.waiting_for_hmu = False
-							self.request_next()
-						else:
-							self.cancel()
-							sleep_time = 0.001
+		if self.status == Resource.ADVERTISED:
+			sleep_time = (self.adv_sent+self.default_timeout)-time.time()
+			if sleep_time < 0:
+				if self.retries_left <= 0:
+					RNS.log("Resource transfer timeout after sending advertisement", RNS.LOG_DEBUG)
+					self.cancel()
+					sleep_time = 0.001
 				else:
-					max_wait = self.rtt * self.timeout_factor * self.max_retries + self.sender_grace_time
-					sleep_time = self.last_activity + max_wait - time.time()
-					if sleep_time < 0:
-						RNS.log("Resource timed out waiting for part requests", RNS.LOG_DEBUG)
-						self.cancel()
-						sleep_time = 0.001
+					RNS.log("No part requests received, retrying resource advertisement...", RNS.LOG_DEBUG)
+					self.retries_left -= 1
+					RNS.Scheduler.dispatch(self.advertisement_packet.resend)
+					self.last_activity = time.time()
+					self.adv_sent = self.last_activity
+					sleep_time = 0.001
+				
+
+		elif self.status == Resource.TRANSFERRING:
+			if not self.initiator:
+				rtt = self.link.rtt if self.rtt == None else self.rtt
+				sleep_time = self.last_activity + (rtt*self.timeout_factor) - time.time()
 
-			elif self.status == Resource.AWAITING_PROOF:
-				sleep_time = self.last_part_sent + (self.rtt*self.timeout_factor+self.sender_grace_time) - time.time()
 				if sleep_time < 0:
-					if self.retries_left <= 0:
-						RNS.log("Resource timed out waiting for proof", RNS.LOG_DEBUG)
-						self.cancel()
+					if self.retries_left > 0:
+						RNS.log("Timeout waiting for parts, requesting retry", RNS.LOG_DEBUG)
 						sleep_time = 0.001
-					else:
-						RNS.log("All parts sent, but no resource proof received, querying network cache...", RNS.LOG_DEBUG)
 						self.retries_left -= 1
+						self.waiting_for_hmu = False
+						self.request_next()
+					else:
+						self.cancel()
+						sleep_time = 0.001
+			else:
+				max_wait = self.rtt * self.timeout_factor * self.max_retries + self.sender_grace_time
+				sleep_time = self.last_activity + max_wait - time.time()
+				if sleep_time < 0:
+					RNS.log("Resource timed out waiting for part requests", RNS.LOG_DEBUG)
+					self.cancel()
+					sleep_time = 0.001
+
+		elif self.status == Resource.AWAITING_PROOF:
+			sleep_time = self.last_part_sent + (self.rtt*self.timeout_factor+self.sender_grace_time) - time.time()
+			if sleep_time < 0:
+				if self.retries_left <= 0:
+					RNS.log("Resource timed out waiting for proof", RNS.LOG_DEBUG)
+					self.cancel()
+					sleep_time = 0.001
+				else:
+					RNS.log("All parts sent, but no resource proof received, querying network cache...", RNS.LOG_DEBUG)
+					self.retries_left -= 1
+					if self.expected_proof_packet_hash == None:
 						expected_data = self.hash + self.expected_proof
 						expected_proof_packet = RNS.Packet(self.link, expected_data, packet_type=RNS.Packet.PROOF, context=RNS.Packet.RESOURCE_PRF)
 						expected_proof_packet.pack()
-						expected_proof_packet.updateHash()
-						RNS.Transport.cache_request(expected_proof_packet.packet_hash)
-						self.last_part_sent = time.time()
-						sleep_time = 0.001
+						self.expected_proof_packet_hash = expected_proof_packet.getHash()
+					RNS.Scheduler.dispatch(RNS.Transport.cache_request, self.expected_proof_packet_hash)
+					self.last_part_sent = time.time()
+					sleep_time = 0.001
 
-			if sleep_time == 0:
-				RNS.log("Warning! Link watchdog sleep time of 0!", RNS.LOG_WARNING)
-			if sleep_time == None or sleep_time < 0:
-				# TODO: This should probably not be here forever
-				RNS.log("Timing error! Closing Reticulum now.", RNS.LOG_CRITICAL)
-				RNS.panic()
+		if sleep_time == 0:
+			RNS.log("Warning! Link watchdog sleep time of 0!", RNS.LOG_WARNING)
+		if sleep_time == None or sleep_time < 0:
+			# TODO: This should probably not be here forever
+			RNS.log("Timing error! Closing Reticulum now.", RNS.LOG_CRITICAL)
+			RNS.panic()
 
-			sleep(sleep_time)
+		RNS.Scheduler.schedule(sleep_time, self.__watchdog_job, this_job_id)
 
 	def assemble(self):
 		if not self.status == Resource.FAILED:
@@ -406,7 +411,7 @@ class Resource:
 				request_data = hmu_part + self.hash + requested_hashes
 				request_packet = RNS.Packet(self.link, request_data, context = RNS.Packet.RESOURCE_REQ)
 
-				request_packet.send()
+				RNS.Scheduler.dispatch(request_packet.send)
 				self.last_activity = time.time()
 				self.req_sent = self.last_activity
 				self.req_resp = None
@@ -429,21 +434,23 @@ class Resource:
 
 			requested_hashes = request_data[pad+RNS.Identity.HASHLENGTH/8:]
 
+			requested_parts = []
 			for i in range(0,len(requested_hashes)/Resource.MAPHASH_LEN):
 				requested_hash = requested_hashes[i*Resource.MAPHASH_LEN:(i+1)*Resource.MAPHASH_LEN]
 				
-				pi = 0
 				for part in self.parts:
 					if part.map_hash == requested_hash:
 						if not part.sent:
-							part.send()
 							self.sent_parts += 1
-						else:
-							part.resend()
-						self.last_activity = time.time()
-						self.last_part_sent = self.last_activity
+						requested_parts.append(part)
 						break
-					pi += 1
+
+			if len(requested_parts) > 0:
+				failed_parts = RNS.Packet.send_batch(requested_parts)
+				if len(failed_parts) > 0:
+					RNS.log("Could not send "+str(len(failed_parts))+" of "+str(len(requested_parts))+" requested parts for "+str(self)+", they will be sent again when requested", RNS.LOG_DEBUG)
+				self.last_activity = time.time()
+				self.last_part_sent = self.last_activity
 
 			if wants_more_hashmap:
 				last_map_hash = request_data[1:Resource.MAPHASH_LEN+1]
@@ -483,14 +490,14 @@ class Resource:
 			if self.initiator:
 				if self.link.status == RNS.Link.ACTIVE:
 					cancel_packet = RNS.Packet(self.link, self.hash, context=RNS.Packet.RESOURCE_ICL)
-					cancel_packet.send()
+					RNS.Scheduler.dispatch(cancel_packet.send)
 				self.link.cancel_outgoing_resource(self)
 			else:
 				self.link.cancel_incoming_resource(self)
 			
 			if self.callback != None:
 				self.link.resource_concluded(self)
-				self.callback(self)
+				RNS.Scheduler.dispatch(self.callback, self)
 
 	def progress_callback(self, callback):
 		self.__progress_callback = callback
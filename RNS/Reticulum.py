@@ -1,4 +1,3 @@
-from Interfaces import *
 import ConfigParser
 from vendor.configobj import ConfigObj
 import RNS
@@ -41,6 +40,12 @@ class Reticulum:
 
 		Reticulum.__allow_unencrypted = False
 		Reticulum.__use_implicit_proof = True
+		Reticulum.__use_hybrid_encryption = False
+		Reticulum.__use_compact_announces = False
+		Reticulum.__aggregate_proofs = False
+		Reticulum.__use_group_aead = False
+		Reticulum.__use_link_aead = True
+		Reticulum.__use_link_acks = True
 
 		if not os.path.isdir(Reticulum.storagepath):
 			os.makedirs(Reticulum.storagepath)
@@ -62,6 +67,9 @@ class Reticulum:
 		RNS.Identity.loadKnownDestinations()
 		Reticulum.router = self
 
+		RNS.KeyPool.start()
+		RNS.CryptoExecutor.start()
+		RNS.Scheduler.start()
 		RNS.Transport.start()
 
 		atexit.register(Reticulum.exit_handler)
@@ -85,6 +93,48 @@ class Reticulum:
 						Reticulum.__use_implicit_proof = True
 					if value == "false":
 						Reticulum.__use_implicit_proof = False
+				if option == "use_hybrid_encryption":
+					if value == "true":
+						Reticulum.__use_hybrid_encryption = True
+					if value == "false":
+						Reticulum.__use_hybrid_encryption = False
+				if option == "use_compact_announces":
+					if value == "true":
+						Reticulum.__use_compact_announces = True
+					if value == "false":
+						Reticulum.__use_compact_announces = False
+				if option == "aggregate_proofs":
+					if value == "true":
+						Reticulum.__aggregate_proofs = True
+					if value == "false":
+						Reticulum.__aggregate_proofs = False
+				if option == "use_group_aead":
+					if value == "true":
+						Reticulum.__use_group_aead = True
+					if value == "false":
+						Reticulum.__use_group_aead = False
+				if option == "use_link_aead":
+					if value == "true":
+						Reticulum.__use_link_aead = True
+					if value == "false":
+						Reticulum.__use_link_aead = False
+				if option == "use_link_acks":
+					if value == "true":
+						Reticulum.__use_link_acks = True
+					if value == "false":
+						Reticulum.__use_link_acks = False
+				if option == "recall_cache_size":
+					RNS.Identity.recall_cache_size = int(value)
+				if option == "verification_cache_size":
+					RNS.Identity.verification_cache_size = int(value)
+				if option == "link_key_pool_depth":
+					RNS.KeyPool.link_key_depth = int(value)
+				if option == "identity_pool_depth":
+					RNS.KeyPool.identity_depth = int(value)
+				if option == "crypto_workers":
+					RNS.CryptoExecutor.workers = int(value)
+				if option == "known_destinations_max_age":
+					RNS.KnownDestinations.max_age = float(value)*24*60*60
 				if option == "allow_unencrypted":
 					if value == "true":
 						RNS.log("", RNS.LOG_CRITICAL)
@@ -118,6 +168,7 @@ class Reticulum:
 					else:
 						interface.OUT = False
 
+					self.applyInterfaceOptions(interface, c)
 					RNS.Transport.interfaces.append(interface)
 
 				if c["type"] == "SerialInterface":
@@ -145,6 +196,7 @@ class Reticulum:
 					else:
 						interface.OUT = False
 
+					self.applyInterfaceOptions(interface, c)
 					RNS.Transport.interfaces.append(interface)
 
 				if c["type"] == "KISSInterface":
@@ -183,6 +235,7 @@ class Reticulum:
 					else:
 						interface.OUT = False
 
+					self.applyInterfaceOptions(interface, c)
 					RNS.Transport.interfaces.append(interface)
 
 				if c["type"] == "AX25KISSInterface":
@@ -226,6 +279,7 @@ class Reticulum:
 					else:
 						interface.OUT = False
 
+					self.applyInterfaceOptions(interface, c)
 					RNS.Transport.interfaces.append(interface)
 
 				if c["type"] == "RNodeInterface":
@@ -254,6 +308,7 @@ class Reticulum:
 					else:
 						interface.OUT = False
 
+					self.applyInterfaceOptions(interface, c)
 					RNS.Transport.interfaces.append(interface)
 
 			except Exception as e:
@@ -261,9 +316,43 @@ class Reticulum:
 				RNS.log("The contained exception was: "+str(e), RNS.LOG_ERROR)
 				
 
+	# Options that work the same way for every
+	# interface type
+	def applyInterfaceOptions(self, interface, c):
+		if "compact_headers" in c and c["compact_headers"].lower() == "true":
+			interface.compact_headers = True
+
+		if "mtu" in c:
+			interface.MTU = int(c["mtu"])
+
 	def createDefaultConfig(self):
 		self.config = ConfigObj()
 		self.config.filename = Reticulum.configpath
+		self.config["reticulum"] = {}
+		self.config["reticulum"]["use_hybrid_encryption"] = "false"
+		self.config["reticulum"].comments["use_hybrid_encryption"] = [
+			"Hybrid encryption makes packets to SINGLE destinations",
+			"smaller and faster to encrypt, but nodes running older",
+			"versions can not decrypt them. Only enable it if every",
+			"node you send to supports it."
+		]
+		self.config["reticulum"]["use_compact_announces"] = "false"
+		self.config["reticulum"].comments["use_compact_announces"] = [
+			"",
+			"Compact announces carry a shorter public key, but nodes",
+			"running older versions can not parse them, and will not",
+			"learn destinations announced this way. Only enable it",
+			"if every node on the network supports it."
+		]
+		self.config["reticulum"]["use_group_aead"] = "false"
+		self.config["reticulum"].comments["use_group_aead"] = [
+			"",
+			"Packets to GROUP destinations can be encrypted with",
+			"AES-GCM instead of Fernet, which is faster and adds less",
+			"overhead. Nodes running older versions can not decrypt",
+			"them, so only enable it if every member of your groups",
+			"supports it."
+		]
 		self.config["interfaces"] = {}
 		self.config["interfaces"]["Default UDP Interface"] = {}
 		self.config["interfaces"]["Default UDP Interface"]["type"] = "UdpInterface"
@@ -277,10 +366,45 @@ class Reticulum:
 		self.config.write()
 		self.applyConfig()
 
+	@staticmethod
+	def get_statistics():
+		return {
+			"recall_cache": RNS.Identity.recallCacheStatistics(),
+			"verification_cache": RNS.Identity.verificationCacheStatistics()
+		}
+
 	@staticmethod
 	def should_allow_unencrypted():
 		return Reticulum.__allow_unencrypted
 
 	@staticmethod
 	def should_use_implicit_proof():
-		return Reticulum.__use_implicit_proof
\ No newline at end of file
+		return Reticulum.__use_implicit_proof
+
+	@staticmethod
+	def should_use_hybrid_encryption():
+		return Reticulum.__use_hybrid_encryption
+
+	@staticmethod
+	def should_use_compact_announces():
+		return Reticulum.__use_compact_announces
+
+	@staticmethod
+	def should_aggregate_proofs():
+		return Reticulum.__aggregate_proofs
+
+	@staticmethod
+	def should_use_group_aead():
+		return Reticulum.__use_group_aead
+
+	@staticmethod
+	def should_use_link_aead():
+		return Reticulum.__use_link_aead
+
+	@staticmethod
+	def should_use_link_acks():
+		return Reticulum.__use_link_acks
+
+# The interfaces default to Reticulum.MTU, so they
+# are imported once the class has been defined
+from Interfaces import *
@@ -0,0 +1,101 @@
+import RNS
+import time
+import heapq
+import threading
+
+# Runs timed jobs for links and resources from a
+# single thread. Jobs are kept in a heap ordered by
+# their deadline, and the thread sleeps until the
+# earliest one is due, so keepalives, timeouts and
+# retries for any number of links and resources do
+# not need a thread each. Jobs run on the scheduler
+# thread, and should not block for long, so user
+# callbacks and anything that sends packets, which
+# can block on a slow interface, is handed off with
+# dispatch().
+class Scheduler:
+	jobs = []
+	counter = 0
+	condition = threading.Condition()
+	started = False
+	thread = None
+
+	@staticmethod
+	def start():
+		with Scheduler.condition:
+			if not Scheduler.started:
+				Scheduler.started = True
+				Scheduler.thread = threading.Thread(target=Scheduler.runLoop)
+				Scheduler.thread.setDaemon(True)
+				Scheduler.thread.start()
+
+	# Schedules callback(*args) to run after delay
+	# seconds. Returns a handle that can be passed
+	# to cancel().
+	@staticmethod
+	def schedule(delay, callback, *args):
+		if not Scheduler.started:
+			Scheduler.start()
+
+		with Scheduler.condition:
+			Scheduler.counter += 1
+			job = [time.time()+delay, Scheduler.counter, callback, args]
+			heapq.heappush(Scheduler.jobs, job)
+			if Scheduler.jobs[0] is job:
+				Scheduler.condition.notify()
+
+		return job
+
+	# Cancelled jobs stay in the heap, but are
+	# skipped when their deadline comes up
+	@staticmethod
+	def cancel(job):
+		if job != None:
+			job[2] = None
+
+	# Runs callback(*args) so that it can not hold
+	# up other jobs. On the scheduler thread it gets
+	# a thread of its own, anywhere else it is just
+	# called directly.
+	@staticmethod
+	def dispatch(callback, *args):
+		if threading.current_thread() is Scheduler.thread:
+			thread = threading.Thread(target=Scheduler.runCallback, args=(callback, args))
+			thread.setDaemon(True)
+			thread.start()
+		else:
+			callback(*args)
+
+	@staticmethod
+	def runCallback(callback, args):
+		try:
+			callback(*args)
+		except Exception as e:
+			RNS.log("Error while running callback "+str(callback)+". The contained exception was: "+str(e), RNS.LOG_ERROR)
+
+	@staticmethod
+	def pending():
+		return len(Scheduler.jobs)
+
+	@staticmethod
+	def runLoop():
+		while True:
+			with Scheduler.condition:
+				while True:
+					if len(Scheduler.jobs) == 0:
+						Scheduler.condition.wait()
+					else:
+						wait_time = Scheduler.jobs[0][0] - time.time()
+						if wait_time > 0:
+							Scheduler.condition.wait(wait_time)
+						else:
+							break
+
+				job = heapq.heappop(Scheduler.jobs)
+
+			callback = job[2]
+			if callback != None:
+				try:
+					callback(*job[3])
+				except Exception as e:
+					RNS.log("Error while running scheduled job "+str(callback)+". The contained exception was: "+str(e), RNS.LOG_ERROR)
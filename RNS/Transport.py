@@ -28,6 +28,12 @@ class Transport:
 	PATHFINDER_RW   = 10		# Random window for announce rebroadcast
 	PATHFINDER_E    = 60*15		# Path expiration in seconds
 
+	# How long to remember which interface a packet
+	# arrived on, so a proof can be routed back to it.
+	# Receipts time out after a minute by default, so
+	# proofs arriving later than that are of no use.
+	REVERSE_TIMEOUT = 60
+
 	# TODO: Calculate an optimal number for this in
 	# various situations
 	LOCAL_REBROADCASTS_MAX = 2	# How many local rebroadcasts of an announce is allowed
@@ -36,19 +42,41 @@ class Transport:
 	destinations    = []		# All active destinations
 	pending_links   = []		# Links that are being established
 	active_links	= []		# Links that are active
+	compact_links   = {}		# Links using compact headers, keyed by their compact address
 	packet_hashlist = []		# A list of packet hashes for duplicate detection
 	receipts		= []		# Receipts of all outgoing packets for proof processing
+	receipt_index	= {}		# Outstanding receipts by the proof destination hash
+	pending_proofs	= {}		# Proofs waiting to be sent in one aggregate
+	announce_schedule = []		# Local destinations that announce periodically
 
 	announce_table    = {}		# A table for storing announces currently waiting to be retransmitted
 	destination_table = {}		# A lookup table containing the next hop to a given destination
-
-	jobs_locked = False
-	jobs_running = False
+	reverse_table     = {}		# A lookup table for routing proofs back to the interface the proved packet came from
+
+	# Held by the job loop, and by anything that
+	# changes the tables and lists above, so they
+	# are never changed while being walked. The
+	# slow parts of inbound processing, such as
+	# signature checks and decryption, are done
+	# without holding it.
+	jobs_lock = threading.RLock()
 	job_interval = 0.250
+
+	# How long received packets are collected
+	# before one aggregated proof is sent for them
+	proof_aggregation_window = 0.5
+
+	# Minimum time between periodic announces from
+	# local destinations, so they do not all go out
+	# at once on a shared channel
+	announce_spacing = 2.0
+	last_scheduled_announce = 0.0
 	receipts_last_checked    = 0.0
 	receipts_check_interval  = 1.0
 	announces_last_checked   = 0.0
 	announces_check_interval = 1.0
+	tables_last_culled       = 0.0
+	tables_cull_interval     = 5.0
 	hashlist_maxsize         = 1000000
 
 	identity = None
@@ -92,17 +120,18 @@ class Transport:
 	@staticmethod
 	def jobs():
 		outgoing = []
-		Transport.jobs_running = True
-		try:
-			if not Transport.jobs_locked:
+		scheduled_announces = []
+		pending_proofs = []
+		with Transport.jobs_lock:
+			try:
 				# Process receipts list for timed-out packets
 				if time.time() > Transport.receipts_last_checked+Transport.receipts_check_interval:
-					for receipt in Transport.receipts:
+					for receipt in list(Transport.receipts):
 						thread = threading.Thread(target=receipt.check_timeout)
 						thread.setDaemon(True)
 						thread.start()
 						if receipt.status != RNS.PacketReceipt.SENT:
-							Transport.receipts.remove(receipt)
+							Transport.removeReceipt(receipt)
 
 					Transport.receipts_last_checked = time.time()
 
@@ -136,28 +165,97 @@ class Transport:
 					Transport.announces_last_checked = time.time()
 
 
+				# Send the most overdue periodic announce
+				# from a local destination
+				if len(Transport.announce_schedule) > 0 and time.time() > Transport.last_scheduled_announce+Transport.announce_spacing:
+					due_destination = None
+					for destination in Transport.announce_schedule:
+						if time.time() >= destination.next_announce:
+							if due_destination == None or destination.next_announce < due_destination.next_announce:
+								due_destination = destination
+
+					if due_destination != None:
+						due_destination.scheduleNextAnnounce()
+						scheduled_announces.append(due_destination)
+						Transport.last_scheduled_announce = time.time()
+
+				# Collect aggregated proofs for packets whose
+				# aggregation window has passed. They are signed
+				# after the lock is released.
+				if len(Transport.pending_proofs) > 0:
+					now = time.time()
+					for proof_key in list(Transport.pending_proofs):
+						pending_entry = Transport.pending_proofs[proof_key]
+						if now > pending_entry[0]+Transport.proof_aggregation_window:
+							Transport.pending_proofs.pop(proof_key)
+							pending_proofs.append(pending_entry)
+
 				# Cull the packet hashlist if it has reached max size
 				while (len(Transport.packet_hashlist) > Transport.hashlist_maxsize):
 					Transport.packet_hashlist.pop(0)
 
-		except Exception as e:
-			RNS.log("An exception occurred while running Transport jobs.", RNS.LOG_ERROR)
-			RNS.log("The contained exception was: "+str(e), RNS.LOG_ERROR)
-			traceback.print_exc()
+				# Cull the reverse table of entries that have expired
+				if time.time() > Transport.tables_last_culled+Transport.tables_cull_interval:
+					stale_reverse_entries = []
+					for truncated_packet_hash in Transport.reverse_table:
+						reverse_entry = Transport.reverse_table[truncated_packet_hash]
+						if time.time() > reverse_entry[1] + Transport.REVERSE_TIMEOUT:
+							stale_reverse_entries.append(truncated_packet_hash)
 
-		Transport.jobs_running = False
+					for truncated_packet_hash in stale_reverse_entries:
+						Transport.reverse_table.pop(truncated_packet_hash)
+
+					Transport.tables_last_culled = time.time()
+
+			except Exception as e:
+				RNS.log("An exception occurred while running Transport jobs.", RNS.LOG_ERROR)
+				RNS.log("The contained exception was: "+str(e), RNS.LOG_ERROR)
+				traceback.print_exc()
+
+		for pending_entry in pending_proofs:
+			try:
+				outgoing.extend(pending_entry[1].identity.aggregateProofs(pending_entry[2]))
+			except Exception as e:
+				RNS.log("Error while signing aggregated proofs. The contained exception was: "+str(e), RNS.LOG_ERROR)
 
 		for packet in outgoing:
 			packet.send()
 
+		for destination in scheduled_announces:
+			destination.announce(destination.announce_app_data)
+
 	@staticmethod
 	def outbound(packet):
-		while (Transport.jobs_running):
-			sleep(0.01)
+		with Transport.jobs_lock:
+			return Transport.__transmit(packet)
 
-		Transport.jobs_locked = True
+	# Sends a sequence of packets in one pass, waiting for
+	# and locking out the job loop only once for all of
+	# them. Returns the packets that were not sent.
+	@staticmethod
+	def outbound_batch(packets):
+		failed = []
+		with Transport.jobs_lock:
+			for packet in packets:
+				if not Transport.__transmit(packet):
+					failed.append(packet)
+
+		return failed
+
+	@staticmethod
+	def __transmit(packet):
 		packet.updateHash()
 		sent = False
+
+		# If this is a proof for a packet we received, and we
+		# know which interface that packet arrived on, the proof
+		# is only sent back on that interface instead of on all
+		reverse_interface = None
+		if packet.packet_type == RNS.Packet.PROOF and packet.destination.type != RNS.Destination.LINK:
+			if packet.destination.hash in Transport.reverse_table:
+				reverse_entry = Transport.reverse_table.pop(packet.destination.hash)
+				if reverse_entry[0] in Transport.interfaces and reverse_entry[0].OUT:
+					reverse_interface = reverse_entry[0]
 		
 		for interface in Transport.interfaces:
 			if interface.OUT:
@@ -168,6 +266,13 @@ class Transport:
 					if interface != packet.destination.attached_interface:
 						should_transmit = False
 
+				if reverse_interface != None and interface != reverse_interface:
+					should_transmit = False
+
+				if len(packet.raw) > interface.MTU:
+					RNS.log("Not transmitting "+str(len(packet.raw))+" byte packet via "+str(interface)+", since it exceeds the interface MTU", RNS.LOG_DEBUG)
+					should_transmit = False
+
 				if should_transmit:
 					# TODO: Remove
 					RNS.log("Transmitting "+str(len(packet.raw))+" bytes via: "+str(interface), RNS.LOG_EXTREME)
@@ -181,11 +286,10 @@ class Transport:
 
 			if (packet.packet_type == RNS.Packet.DATA):
 				packet.receipt = RNS.PacketReceipt(packet)
-				Transport.receipts.append(packet.receipt)
+				Transport.addReceipt(packet.receipt)
 			
 			Transport.cache(packet)
 
-		Transport.jobs_locked = False
 		return sent
 
 	@staticmethod
@@ -204,33 +308,64 @@ class Transport:
 
 	@staticmethod
 	def inbound(raw, interface=None):
-		while (Transport.jobs_running):
-			sleep(0.1)
-			
-		Transport.jobs_locked = True
-		
 		packet = RNS.Packet(None, raw)
 		packet.unpack()
 		packet.updateHash()
 		packet.receiving_interface = interface
 
-		RNS.log(str(interface)+" received packet with hash "+RNS.prettyhexrep(packet.packet_hash), RNS.LOG_EXTREME)
+		with Transport.jobs_lock:
+			# Packets with compact headers only carry a short
+			# link address, which is mapped back to the link ID
+			if packet.header_type == RNS.Packet.HEADER_3:
+				if packet.destination_hash in Transport.compact_links:
+					packet.destination_hash = Transport.compact_links[packet.destination_hash].link_id
+				else:
+					RNS.log("Dropped compact header packet for unknown link address "+RNS.prettyhexrep(packet.destination_hash), RNS.LOG_DEBUG)
+					return
+
+			RNS.log(str(interface)+" received packet with hash "+RNS.prettyhexrep(packet.packet_hash), RNS.LOG_EXTREME)
 
-		# TODO: Rewrite these redundant cache calls
-		if Transport.packet_filter(packet):
+			# TODO: Rewrite these redundant cache calls
+			if not Transport.packet_filter(packet):
+				return
 			Transport.packet_hashlist.append(packet.packet_hash)
-			
-			if packet.packet_type == RNS.Packet.ANNOUNCE:
-				if RNS.Identity.validateAnnounce(packet):
+
+		# Signature checks, decryption and proving can
+		# be handed to the crypto executor, so they do
+		# not hold up the interface that received the
+		# packet. Packets for the same destination or
+		# link are always processed in order.
+		if RNS.CryptoExecutor.enabled():
+			RNS.CryptoExecutor.submit(Transport.executorKey(packet), Transport.processInbound, packet)
+		else:
+			Transport.processInbound(packet)
+
+	# A link request is keyed by the ID of the link it
+	# creates, so the request and all later traffic on
+	# the link are handled by the same crypto worker
+	@staticmethod
+	def executorKey(packet):
+		if packet.packet_type == RNS.Packet.LINKREQUEST:
+			return RNS.Identity.truncatedHash(packet.raw)
+		else:
+			return packet.destination_hash
+
+	@staticmethod
+	def processInbound(packet):
+		if packet.packet_type == RNS.Packet.ANNOUNCE:
+			if RNS.Identity.validateAnnounce(packet):
+				# The signature has been checked, the tables
+				# are only locked while they are updated
+				with Transport.jobs_lock:
 					if (packet.transport_id != None):
 						received_from = packet.transport_id
-						
+					
 						# Check if this is a next retransmission from
 						# another node. If it is, we're removing the
 						# announce in question from our pending table
 						if packet.destination_hash in Transport.announce_table:
 							announce_entry = Transport.announce_table[packet.destination_hash]
-							
+						
 							if packet.hops == announce_entry[4]:
 								RNS.log("Heard a local rebroadcast of announce for "+RNS.prettyhexrep(packet.destination_hash), RNS.LOG_DEBUG)
 								announce_entry[6] += 1
@@ -247,6 +382,17 @@ class Transport:
 					else:
 						received_from = packet.destination_hash
 
+					# Another node rebroadcasting an announce for
+					# one of our own destinations means it is
+					# already well known, so periodic announces
+					# can back off. Only announces carrying the
+					# transport id of some other node count, our
+					# own announce echoing back does not.
+					if packet.transport_id != None and packet.transport_id != Transport.identity.hash:
+						for destination in Transport.destinations:
+							if destination.hash == packet.destination_hash:
+								destination.announce_rebroadcast_heard = True
+
 					# Check if this announce should be inserted into
 					# announce and destination tables
 					should_add = False
@@ -254,7 +400,7 @@ class Transport:
 					# First, check that the announce is not for a destination
 					# local to this system, and that hops are less than the max
 					if (not any(packet.destination_hash == d.hash for d in Transport.destinations) and packet.hops < Transport.PATHFINDER_M+1):
-						random_blob = packet.data[RNS.Identity.DERKEYSIZE/8+10:RNS.Identity.DERKEYSIZE/8+20]
+						random_blob = RNS.Identity.unpackAnnounce(packet.destination_hash, packet.data)[1]
 						random_blobs = []
 						if packet.destination_hash in Transport.destination_table:
 							random_blobs = Transport.destination_table[packet.destination_hash][4]
@@ -303,100 +449,204 @@ class Transport:
 							retransmit_timeout = now + math.pow(Transport.PATHFINDER_C, packet.hops) + (RNS.rand() * Transport.PATHFINDER_RW)
 							Transport.announce_table[packet.destination_hash] = [now, retransmit_timeout, retries, received_from, packet.hops, packet, local_rebroadcasts]
 							Transport.destination_table[packet.destination_hash] = [now, received_from, packet.hops, expires, random_blobs]
-			
-			elif packet.packet_type == RNS.Packet.LINKREQUEST:
+		
+		elif packet.packet_type == RNS.Packet.LINKREQUEST:
+			for destination in Transport.destinations:
+				if destination.hash == packet.destination_hash and destination.type == packet.destination_type:
+					packet.destination = destination
+					destination.receive(packet)
+					Transport.cache(packet)
+		
+		elif packet.packet_type == RNS.Packet.DATA:
+			if packet.destination_type == RNS.Destination.LINK:
+				for link in Transport.active_links:
+					if link.link_id == packet.destination_hash:
+						packet.link = link
+						link.receive(packet)
+						Transport.cache(packet)
+			else:
 				for destination in Transport.destinations:
 					if destination.hash == packet.destination_hash and destination.type == packet.destination_type:
+						# Remember where the packet came from, so a
+						# proof for it can be routed back the same way
+						with Transport.jobs_lock:
+							Transport.reverse_table[packet.packet_hash[:10]] = [packet.receiving_interface, time.time()]
+
 						packet.destination = destination
 						destination.receive(packet)
 						Transport.cache(packet)
-			
-			elif packet.packet_type == RNS.Packet.DATA:
+
+						if destination.proof_strategy == RNS.Destination.PROVE_ALL:
+							packet.prove()
+
+						elif destination.proof_strategy == RNS.Destination.PROVE_APP:
+							if destination.callbacks.proof_requested:
+								if destination.callbacks.proof_requested(packet):
+									packet.prove()
+
+		elif packet.packet_type == RNS.Packet.PROOF:
+			if packet.context == RNS.Packet.LRPROOF:
+				# This is a link request proof, forward
+				# to a waiting link request
+				for link in Transport.pending_links:
+					if link.link_id == packet.destination_hash:
+						link.validateProof(packet)
+			elif packet.context == RNS.Packet.RESOURCE_PRF:
+				for link in Transport.active_links:
+					if link.link_id == packet.destination_hash:
+						link.receive(packet)
+			elif packet.context == RNS.Packet.PROOF_AGGREGATE:
+				# The length of the signature at the end
+				# depends on the identity type, so each
+				# possible split of the hash list is tried
+				hashlength = RNS.Identity.AGGREGATE_HASHLENGTH/8
+				for siglength in [RNS.Identity.SIGLENGTH/8, RNS.Identity.CURVE25519_SIGLENGTH/8]:
+					hashes = packet.data[:-siglength]
+					if len(hashes) > 0 and len(hashes) % hashlength == 0:
+						for i in range(0, len(hashes), hashlength):
+							index_hash = hashes[i:i+hashlength][:RNS.Identity.TRUNCATED_HASHLENGTH/8]
+							for receipt in list(Transport.receipt_index.get(index_hash, [])):
+								if receipt.validateAggregateProof(packet.data):
+									Transport.removeReceipt(receipt)
+			elif packet.context == RNS.Packet.LINKPROOF:
+				# A batched ack for packets sent over a link.
+				# The link checks the MAC once, and then every
+				# receipt it covers is resolved.
+				for link in Transport.active_links:
+					if link.link_id == packet.destination_hash:
+						acked_hashes = link.validateAcks(packet.data)
+						if acked_hashes != None:
+							for acked_hash in acked_hashes:
+								for receipt in list(Transport.receipt_index.get(acked_hash[:RNS.Identity.TRUNCATED_HASHLENGTH/8], [])):
+									if receipt.validateLinkAck(acked_hash, link):
+										Transport.removeReceipt(receipt)
+			else:
 				if packet.destination_type == RNS.Destination.LINK:
 					for link in Transport.active_links:
 						if link.link_id == packet.destination_hash:
 							packet.link = link
-							link.receive(packet)
-							Transport.cache(packet)
+							# plaintext = link.decrypt(packet.data)
+							
+
+				# TODO: Make sure everything uses new proof handling
+				if len(packet.data) in RNS.PacketReceipt.explicit_lengths:
+					proof_hash = packet.data[:RNS.Identity.HASHLENGTH/8]
 				else:
-					for destination in Transport.destinations:
-						if destination.hash == packet.destination_hash and destination.type == packet.destination_type:
-							packet.destination = destination
-							destination.receive(packet)
-							Transport.cache(packet)
-
-							if destination.proof_strategy == RNS.Destination.PROVE_ALL:
-								packet.prove()
-
-							elif destination.proof_strategy == RNS.Destination.PROVE_APP:
-								if destination.callbacks.proof_requested:
-									if destination.callbacks.proof_requested(packet):
-										packet.prove()
-
-			elif packet.packet_type == RNS.Packet.PROOF:
-				if packet.context == RNS.Packet.LRPROOF:
-					# This is a link request proof, forward
-					# to a waiting link request
-					for link in Transport.pending_links:
-						if link.link_id == packet.destination_hash:
-							link.validateProof(packet)
-				elif packet.context == RNS.Packet.RESOURCE_PRF:
-					for link in Transport.active_links:
-						if link.link_id == packet.destination_hash:
-							link.receive(packet)
+					proof_hash = None
+
+				# Proofs are addressed to a destination derived
+				# from the hash of the packet they prove, so the
+				# index narrows the candidates down to the
+				# receipts that can actually match. Proofs over
+				# a link are addressed to the link instead, but
+				# always start with the full packet hash, and
+				# their signature length varies.
+				if proof_hash != None:
+					index_hash = proof_hash[:RNS.Identity.TRUNCATED_HASHLENGTH/8]
+				elif packet.destination_type == RNS.Destination.LINK:
+					index_hash = packet.data[:RNS.Identity.TRUNCATED_HASHLENGTH/8]
 				else:
-					if packet.destination_type == RNS.Destination.LINK:
-						for link in Transport.active_links:
-							if link.link_id == packet.destination_hash:
-								packet.link = link
-								# plaintext = link.decrypt(packet.data)
-								
-
-					# TODO: Make sure everything uses new proof handling
-					if len(packet.data) == RNS.PacketReceipt.EXPL_LENGTH:
-						proof_hash = packet.data[:RNS.Identity.HASHLENGTH/8]
-					else:
-						proof_hash = None
-
-					for receipt in Transport.receipts:
-						receipt_validated = False
-						if proof_hash != None:
-							# Only test validation if hash matches
-							if receipt.hash == proof_hash:
-								receipt_validated = receipt.validateProofPacket(packet)
-						else:
-							# In case of an implicit proof, we have
-							# to check every single outstanding receipt
+					index_hash = packet.destination_hash
+				candidates = Transport.receipt_index.get(index_hash, [])
+
+				for receipt in list(candidates):
+					receipt_validated = False
+					if proof_hash != None:
+						# Only test validation if hash matches
+						if receipt.hash == proof_hash:
 							receipt_validated = receipt.validateProofPacket(packet)
+					else:
+						receipt_validated = receipt.validateProofPacket(packet)
 
-						if receipt_validated:
-							Transport.receipts.remove(receipt)
+					if receipt_validated:
+						Transport.removeReceipt(receipt)
+						break
 
-		Transport.jobs_locked = False
+	@staticmethod
+	def scheduleAnnounces(destination):
+		with Transport.jobs_lock:
+			if not destination in Transport.announce_schedule:
+				Transport.announce_schedule.append(destination)
+
+	@staticmethod
+	def unscheduleAnnounces(destination):
+		with Transport.jobs_lock:
+			if destination in Transport.announce_schedule:
+				Transport.announce_schedule.remove(destination)
+
+	@staticmethod
+	def queueProof(packet):
+		with Transport.jobs_lock:
+			proof_key = (packet.destination.hash, packet.receiving_interface)
+			if not proof_key in Transport.pending_proofs:
+				Transport.pending_proofs[proof_key] = [time.time(), packet.destination, []]
+			Transport.pending_proofs[proof_key][2].append(packet)
+
+	@staticmethod
+	def addReceipt(receipt):
+		with Transport.jobs_lock:
+			Transport.receipts.append(receipt)
+			index_hash = receipt.hash[:RNS.Identity.TRUNCATED_HASHLENGTH/8]
+			if not index_hash in Transport.receipt_index:
+				Transport.receipt_index[index_hash] = []
+			Transport.receipt_index[index_hash].append(receipt)
+
+	@staticmethod
+	def removeReceipt(receipt):
+		with Transport.jobs_lock:
+			if receipt in Transport.receipts:
+				Transport.receipts.remove(receipt)
+			index_hash = receipt.hash[:RNS.Identity.TRUNCATED_HASHLENGTH/8]
+			if index_hash in Transport.receipt_index:
+				bucket = Transport.receipt_index[index_hash]
+				if receipt in bucket:
+					bucket.remove(receipt)
+				if len(bucket) == 0:
+					Transport.receipt_index.pop(index_hash)
 
 	@staticmethod
 	def registerDestination(destination):
-		destination.MTU = RNS.Reticulum.MTU
-		if destination.direction == RNS.Destination.IN:
-			Transport.destinations.append(destination)
+		with Transport.jobs_lock:
+			destination.MTU = RNS.Reticulum.MTU
+			if destination.direction == RNS.Destination.IN:
+				Transport.destinations.append(destination)
 
 	@staticmethod
 	def registerLink(link):
-		RNS.log("Registering link "+str(link), RNS.LOG_DEBUG)
-		if link.initiator:
-			Transport.pending_links.append(link)
-		else:
-			Transport.active_links.append(link)
+		with Transport.jobs_lock:
+			RNS.log("Registering link "+str(link), RNS.LOG_DEBUG)
+			if link.initiator:
+				Transport.pending_links.append(link)
+			else:
+				Transport.active_links.append(link)
+
+	# Reserves the compact address of a link. Returns
+	# False if the address is in use by another link.
+	@staticmethod
+	def registerCompactLink(link):
+		with Transport.jobs_lock:
+			if link.compact_id in Transport.compact_links:
+				return Transport.compact_links[link.compact_id] == link
+			else:
+				Transport.compact_links[link.compact_id] = link
+				return True
+
+	@staticmethod
+	def deregisterCompactLink(link):
+		with Transport.jobs_lock:
+			if link.compact_id in Transport.compact_links and Transport.compact_links[link.compact_id] == link:
+				Transport.compact_links.pop(link.compact_id)
 
 	@staticmethod
 	def activateLink(link):
-		RNS.log("Activating link "+str(link), RNS.LOG_DEBUG)
-		if link in Transport.pending_links:
-			Transport.pending_links.remove(link)
-			Transport.active_links.append(link)
-			link.status = RNS.Link.ACTIVE
-		else:
-			RNS.log("Attempted to activate a link that was not in the pending table", RNS.LOG_ERROR)
+		with Transport.jobs_lock:
+			RNS.log("Activating link "+str(link), RNS.LOG_DEBUG)
+			if link in Transport.pending_links:
+				Transport.pending_links.remove(link)
+				Transport.active_links.append(link)
+				link.status = RNS.Link.ACTIVE
+			else:
+				RNS.log("Attempted to activate a link that was not in the pending table", RNS.LOG_ERROR)
 
 
 	@staticmethod
@@ -412,7 +662,7 @@ class Transport:
 	def cache(packet):
 		if RNS.Transport.shouldCache(packet):
 			try:
-				packet_hash = RNS.hexrep(packet.getHash(), delimit=False)
+				packet_hash = RNS.hexrep(packet.packet_hash, delimit=False)
 				file = open(RNS.Reticulum.cachepath+"/"+packet_hash, "w")
 				file.write(packet.raw)
 				file.close()
@@ -4,8 +4,13 @@ import glob
 import time
 import random
 
+from .CryptoProvider import CryptoProvider
 from .Reticulum import Reticulum
 from .Identity import Identity
+from .KnownDestinations import KnownDestinations
+from .KeyPool import KeyPool
+from .CryptoExecutor import CryptoExecutor
+from .Scheduler import Scheduler
 from .Link import Link
 from .Transport import Transport
 from .Destination import Destination